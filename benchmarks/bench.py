@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks for encode, decode, vocabulary loading and byte pair merging.
+
+The corpora are synthetic and generated from a fixed seed, so runs are reproducible across
+machines. Results are written as JSON and can be compared against a stored baseline:
+
+    python benchmarks/bench.py --output results.json
+    python benchmarks/bench.py --baseline results.json --tolerance 0.1
+
+Comparison exits with status 1 if any throughput dropped, or any latency, memory or load time
+grew, by more than the tolerance.
+"""
+import argparse
+import base64
+import functools
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tiktoken_py.bbpe import MERGE_ENGINES, PairRanks  # noqa: E402
+from tiktoken_py.core import Encoding  # noqa: E402
+from tiktoken_py.load import load_tktoken_bpe  # noqa: E402
+from tiktoken_py.openai_public import ENCODING_CONSTRUCTORS  # noqa: E402
+
+ENCODINGS = ["cl100k_base", "o200k_base"]
+
+VOCABULARY_FILES = {
+    "cl100k_base": "encodings/cl100k/cl100k_base.tiktoken",
+    "o200k_base": "encodings/o200k/o200k_base.tiktoken",
+}
+
+_WORDS = (
+    "the of and to in is was that for it with as on be at by this had not are but from or have "
+    "an they which one you were her all she there would their we him been has when who will more "
+    "no if out so said what up its about into than them can only other new some could time these "
+    "two may then do first any my now such like our over man me even most made after also did "
+    "many before must through back years where much your way well down should because each just "
+    "those people how too little state good very make world still own see men work long get here "
+    "between both life being under never day same another know while last might us great old year"
+).split()
+
+_CODE_LINES = [
+    "def {name}(self, {arg}: int = {num}) -> Optional[str]:",
+    "    if {arg} is None:",
+    "        raise ValueError(f\"invalid {arg}: {{{arg}!r}}\")",
+    "    for i in range(len({name}_items)):",
+    "        result[{num}] = {arg}.get(\"{name}\", {num}) + 0x{hex}",
+    "    return {{\"{name}\": [{num}, {num}, {num}], \"ok\": True}}",
+    "class {cls}({cls}Base):",
+    "    # TODO({name}): handle the {arg} case",
+    "import {name}.{arg} as {arg}_mod",
+]
+
+
+def _english(rng: random.Random, size: int) -> str:
+    out, n = [], 0
+    while n < size:
+        sentence = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(5, 20)))
+        sentence = sentence[0].upper() + sentence[1:] + rng.choice([".", ".", ".", "?", "!"])
+        if rng.random() < 0.15:
+            sentence += "\n\n"
+        out.append(sentence)
+        n += len(sentence) + 1
+    return " ".join(out)[:size]
+
+
+def _code(rng: random.Random, size: int) -> str:
+    out, n = [], 0
+    while n < size:
+        line = rng.choice(_CODE_LINES).format(
+            name=rng.choice(_WORDS) + "_" + rng.choice(_WORDS),
+            arg=rng.choice(_WORDS) + str(rng.randint(0, 9)),
+            cls="".join(w.capitalize() for w in rng.sample(_WORDS, 2)),
+            num=rng.randint(0, 10 ** rng.randint(1, 6)),
+            hex="%x" % rng.getrandbits(32),
+        )
+        out.append(line)
+        n += len(line) + 1
+    return "\n".join(out)[:size]
+
+
+def _cjk(rng: random.Random, size: int) -> str:
+    out = []
+    for _ in range(size):
+        r = rng.random()
+        if r < 0.85:
+            out.append(chr(rng.randint(0x4E00, 0x9FFF)))
+        elif r < 0.95:
+            out.append(rng.choice("，。、！？：；「」"))
+        else:
+            out.append(chr(rng.randint(0x3041, 0x3096)))
+    return "".join(out)
+
+
+def _base64(rng: random.Random, size: int) -> str:
+    raw = bytes(rng.getrandbits(8) for _ in range(size * 3 // 4 + 3))
+    return base64.b64encode(raw).decode("ascii")[:size]
+
+
+def _runs(rng: random.Random, size: int) -> str:
+    # Long unsplit pieces: whitespace, digits and repeated punctuation
+    out, n = [], 0
+    while n < size:
+        length = rng.randint(200, 2000)
+        run = rng.choice([
+            " " * length,
+            "\t" * length,
+            "".join(rng.choice("0123456789") for _ in range(length)),
+            "=" * length,
+            "-" * length,
+        ])
+        out.append(run)
+        out.append(rng.choice(_WORDS))
+        n += length
+    return "".join(out)[:size]
+
+
+def _specials(rng: random.Random, size: int) -> str:
+    tokens = ["<|endoftext|>", "<|endofprompt|>", "<|x|>", "<|endof", "|>", "<|"]
+    out, n = [], 0
+    while n < size:
+        piece = rng.choice(tokens) if rng.random() < 0.5 else rng.choice(_WORDS) + " "
+        out.append(piece)
+        n += len(piece)
+    return "".join(out)
+
+
+CORPORA = {
+    "english": _english,
+    "code": _code,
+    "cjk": _cjk,
+    "base64": _base64,
+    "runs": _runs,
+    "specials": _specials,
+}
+
+
+def make_corpora(size: int, seed: int) -> dict[str, str]:
+    return {name: fn(random.Random(f"{seed}:{name}"), size) for name, fn in CORPORA.items()}
+
+
+def _split_documents(text: str, n: int) -> list[str]:
+    step = max(1, len(text) // n)
+    return [text[i: i + step] for i in range(0, len(text), step)]
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def bench_encode(enc, text: str, repeat: int, documents: int) -> dict:
+    # The piece cache is cleared before every timed call, so the encode, latency and offsets
+    # metrics measure the merge path rather than cache hits; encode_warm_mb_s reports the cached
+    # throughput separately
+    encode = enc.encode
+    nbytes = len(text.encode("utf-8"))
+
+    best, tokens = float("inf"), None
+    for _ in range(repeat):
+        enc.cache_clear()
+        start = time.perf_counter()
+        tokens = encode(text, allowed_special="all")
+        best = min(best, time.perf_counter() - start)
+
+    warm_best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encode(text, allowed_special="all")
+        warm_best = min(warm_best, time.perf_counter() - start)
+
+    latencies = []
+    for doc in _split_documents(text, documents):
+        enc.cache_clear()
+        start = time.perf_counter()
+        encode(doc, allowed_special="all")
+        latencies.append(time.perf_counter() - start)
+
+    enc.cache_clear()
+    gc.collect()
+    tracemalloc.start()
+    encode(text, allowed_special="all")
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # encode_with_offsets compared with encode under the same conditions, timed alternately so that
+    # load on the machine affects both alike
+    offsets_best = plain_best = float("inf")
+    for _ in range(repeat):
+        enc.cache_clear()
+        start = time.perf_counter()
+        encode(text, allowed_special="all")
+        plain_best = min(plain_best, time.perf_counter() - start)
+        enc.cache_clear()
+        start = time.perf_counter()
+        with_offsets = enc.encode_with_offsets(text, allowed_special="all")
+        offsets_best = min(offsets_best, time.perf_counter() - start)
+    assert with_offsets.tokens == tokens, "encode_with_offsets returned different tokens"
+
+    start = time.perf_counter()
+    decoded = enc.decode(tokens)
+    decode_seconds = time.perf_counter() - start
+    assert decoded == text, "encode/decode round trip failed"
+
+    return {
+        "encode_mb_s": nbytes / best / 1e6,
+        "encode_tokens_s": len(tokens) / best,
+        "encode_warm_mb_s": nbytes / warm_best / 1e6,
+        "encode_p50_ms": _percentile(latencies, 0.5) * 1e3,
+        "encode_p99_ms": _percentile(latencies, 0.99) * 1e3,
+        "encode_peak_mb": peak / 1e6,
+        "decode_mb_s": nbytes / max(decode_seconds, 1e-9) / 1e6,
+        "offsets_mb_s": nbytes / offsets_best / 1e6,
+        "offsets_overhead": offsets_best / plain_best - 1,
+        "tokens": len(tokens),
+    }
+
+
+def bench_merge(enc, piece_lengths: list[int], seed: int) -> dict:
+    ranks = enc._mergeable_ranks
+    rng = random.Random(f"{seed}:merge")
+    start = time.perf_counter()
+    pair_ranks = PairRanks(ranks)
+    results = {"pair_ranks_build_ms": (time.perf_counter() - start) * 1e3}
+    engines = {name: functools.partial(merge, ranks) for name, merge in MERGE_ENGINES.items()}
+    engines["pair"] = pair_ranks.merge
+    for length in piece_lengths:
+        piece = _base64(rng, length).encode("ascii")
+        for name, merge in engines.items():
+            start = time.perf_counter()
+            merge(piece)
+            results[f"merge_{name}_{length}_ms"] = (time.perf_counter() - start) * 1e3
+    return results
+
+
+def bench_load(name: str) -> dict:
+    start = time.perf_counter()
+    load_tktoken_bpe(VOCABULARY_FILES[name])
+    load_seconds = time.perf_counter() - start
+
+    # Cold start: a fresh interpreter importing the package, building the encoding and encoding
+    # a short string
+    code = (
+        "import time; start = time.perf_counter(); import tiktoken_py; "
+        f"tiktoken_py.get_encoding({name!r}).encode('hello world'); "
+        "print(time.perf_counter() - start)"
+    )
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=root, check=True, capture_output=True, text=True
+    )
+    return {"load_ms": load_seconds * 1e3, "cold_start_ms": float(out.stdout) * 1e3}
+
+
+def run(args) -> dict:
+    corpora = make_corpora(args.size, args.seed)
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "size": args.size,
+            "seed": args.seed,
+            "merge_engine": args.merge_engine,
+            "compact_ranks": args.compact_ranks,
+        },
+        "results": {},
+    }
+    for name in args.encodings:
+        print(f"{name}: load", file=sys.stderr)
+        metrics = bench_load(name)
+        enc = Encoding(**ENCODING_CONSTRUCTORS[name](), merge_engine=args.merge_engine,
+                       compact_ranks=args.compact_ranks)
+        for corpus, text in corpora.items():
+            print(f"{name}: {corpus}", file=sys.stderr)
+            for key, value in bench_encode(enc, text, args.repeat, args.documents).items():
+                metrics[f"{corpus}.{key}"] = value
+        metrics.update(bench_merge(enc, args.merge_lengths, args.seed))
+        results["results"][name] = metrics
+    return results
+
+
+# Metrics where a higher value is better; for all others (times, memory) lower is better
+_HIGHER_IS_BETTER = ("_mb_s", "_tokens_s")
+# Metrics that are informational only; the overhead is a ratio close to 0, so relative changes of
+# it are noise, and offsets_mb_s already tracks the throughput
+_IGNORED = ("tokens", "offsets_overhead")
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, metrics in current["results"].items():
+        for key, value in metrics.items():
+            if key.rsplit(".", 1)[-1] in _IGNORED:
+                continue
+            old = baseline.get("results", {}).get(name, {}).get(key)
+            if not old:
+                continue
+            if key.endswith(_HIGHER_IS_BETTER):
+                change = (old - value) / old
+            else:
+                change = (value - old) / old
+            if change > tolerance:
+                regressions.append(f"{name} {key}: {old:.4g} -> {value:.4g} ({change:+.1%} worse)")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--encodings", nargs="+", default=ENCODINGS, choices=ENCODINGS)
+    parser.add_argument("--size", type=int, default=1 << 17,
+                        help="characters per corpus (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="repetitions for throughput, the best is kept (default: %(default)s)")
+    parser.add_argument("--documents", type=int, default=200,
+                        help="documents per corpus for latency percentiles (default: %(default)s)")
+    parser.add_argument("--merge-lengths", type=int, nargs="+", default=[256, 1024, 4096])
+    parser.add_argument("--merge-engine", default="scan", choices=sorted([*MERGE_ENGINES, "pair"]))
+    parser.add_argument("--compact-ranks", action="store_true",
+                        help="store the mergeable ranks as CompactRanks instead of a dict")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against results stored in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed relative regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("no regressions", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
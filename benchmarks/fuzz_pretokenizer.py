@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Differential fuzzing of the fast pre-tokenizer against the `regex` reference.
+
+Every generated text is split with `FastPreTokenizer.finditer` and with the encoding's compiled
+split regex (`CoreBPE.regex_tls.finditer`), and the piece spans must be identical, also for random
+`pos`/`endpos` ranges as used by the streaming encoder. The corpora of bench.py are included
+along with random texts drawn from an alphabet biased towards the characters the patterns treat
+specially. Exits with status 1 on the first mismatch:
+
+    python benchmarks/fuzz_pretokenizer.py --iterations 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench import make_corpora  # noqa: E402
+from tiktoken_py.core import Encoding  # noqa: E402
+from tiktoken_py.openai_public import ENCODING_CONSTRUCTORS  # noqa: E402
+from tiktoken_py.pretokenize import FastPreTokenizer  # noqa: E402
+
+ENCODINGS = ["cl100k_base", "o200k_base"]
+
+# All ASCII, plus letters, marks, digits and spaces from other scripts
+_ASCII = [chr(c) for c in range(128)]
+_UNICODE = list("éÉßſKǅʰˆ中文字ひらカナ한국어ΣσςЖж٣߀²½́̈   　\x85🤖😀")
+_FRAGMENTS = [
+    "'s", "'S", "'t", "'re", "'VE", "'ll", "'d", "'m", " '", "''", "don't", "I'M",
+    "\r\n", "\n\n", "  \n", " \t ", "\n ", "    ", "123", "1234567", "x/y", "a/\n",
+    "HTTPServer", "camelCase", "ABCdef", "<|endoftext|>", "...\n\n", "!?", " -- ",
+]
+
+
+def random_text(rng: random.Random, length: int, ascii_only: bool) -> str:
+    out = []
+    while len(out) < length:
+        r = rng.random()
+        if r < 0.25:
+            out.append(rng.choice(_FRAGMENTS))
+        elif r < 0.35 and not ascii_only:
+            out.append(rng.choice(_UNICODE))
+        elif r < 0.55:
+            out.append(rng.choice(" \n\t\r"))
+        else:
+            out.append(rng.choice(_ASCII))
+    return "".join(out)
+
+
+def spans(matches) -> list[tuple[int, int]]:
+    return [m.span() for m in matches]
+
+
+def check(fast: FastPreTokenizer, reference, text: str, pos: int = 0, endpos=None) -> None:
+    end = len(text) if endpos is None else endpos
+    expected = spans(reference.finditer(text, pos, end))
+    actual = spans(fast.finditer(text, pos, endpos))
+    if actual != expected:
+        for i, (a, e) in enumerate(zip(actual, expected)):
+            if a != e:
+                break
+        else:
+            i = min(len(actual), len(expected))
+        context = text[max(0, (expected[i:i + 1] or [(end, end)])[0][0] - 20):][:60]
+        raise AssertionError(
+            f"pos={pos} endpos={endpos}: piece {i} differs "
+            f"(fast {actual[i:i + 1]}, regex {expected[i:i + 1]}) near {context!r}"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--encodings", nargs="+", default=ENCODINGS, choices=ENCODINGS)
+    parser.add_argument("--iterations", type=int, default=5000,
+                        help="random texts per encoding (default: %(default)s)")
+    parser.add_argument("--max-length", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for name in args.encodings:
+        constructor = ENCODING_CONSTRUCTORS[name]()
+        enc = Encoding(**constructor, pretokenizer="fast")
+        core_bpe = enc._core_bpe
+        fast, reference = core_bpe.pretokenizer_tls, core_bpe.regex_tls
+        # Small segments exercise the switching between the two patterns
+        small = FastPreTokenizer(constructor["pat_str"], segment_size=8)
+        rng = random.Random(f"{args.seed}:{name}")
+
+        start = time.perf_counter()
+        for text in make_corpora(1 << 16, args.seed).values():
+            check(fast, reference, text)
+            check(small, reference, text)
+        for i in range(args.iterations):
+            text = random_text(rng, rng.randint(0, args.max_length), ascii_only=i % 2 == 0)
+            check(fast, reference, text)
+            check(small, reference, text)
+            pos = rng.randint(0, len(text))
+            endpos = rng.randint(pos, len(text))
+            check(fast, reference, text, pos, endpos)
+            check(small, reference, text, pos, endpos)
+        print(f"{name}: {args.iterations} texts ok in {time.perf_counter() - start:.1f}s",
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
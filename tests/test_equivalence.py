@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Differential tests: every alternative code path must give exactly the tokens of `encode`.
+
+The inputs are small seeded fuzz loops over texts built from the characters and fragments the
+split patterns treat specially, so failures are reproducible.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import random
+
+import numpy as np
+import pytest
+
+from tiktoken_py.bbpe import MERGE_ENGINES, PairRanks
+from tiktoken_py.core import Encoding
+from tiktoken_py.openai_public import ENCODING_CONSTRUCTORS
+from tiktoken_py.registry import get_encoding
+
+ENCODING_NAMES = ["cl100k_base", "o200k_base"]
+ITERATIONS = 60
+
+_ALPHABET = list("abcXYZ019 .,!?'/-_=\t") + list("éßΣж中文ひら한🙂́　")
+_FRAGMENTS = [
+    "'s", "'T", "'re", "don't", " '", "\r\n", "\n\n", "  \n", "\n ", "    ", "1234567",
+    "HTTPServer", "camelCase", "<|endoftext|>", "<|endofprompt|>", "<|endof", "...\n\n",
+    "aGVsbG8gd29ybGQ=", "========",
+]
+
+
+def random_text(rng: random.Random, max_length: int = 300) -> str:
+    out = []
+    for _ in range(rng.randint(0, max_length)):
+        if rng.random() < 0.2:
+            out.append(rng.choice(_FRAGMENTS))
+        else:
+            out.append(rng.choice(_ALPHABET))
+    return "".join(out)
+
+
+def texts(seed: str, n: int = ITERATIONS, max_length: int = 300) -> list[str]:
+    rng = random.Random(seed)
+    return [random_text(rng, max_length) for _ in range(n)]
+
+
+@pytest.fixture(scope="module", params=ENCODING_NAMES)
+def enc(request) -> Encoding:
+    return get_encoding(request.param)
+
+
+def test_merge_engines_match_byte_pair_merge(enc):
+    ranks = enc._mergeable_ranks
+    pair_ranks = PairRanks(ranks)
+    rng = random.Random(f"merge:{enc.name}")
+    for _ in range(ITERATIONS):
+        # 长度超过 128 字节的片段会走 PairRanks.merge 的最小堆分支
+        length = rng.choice([2, 5, 17, 100, 200, 600])
+        piece = "".join(rng.choice(_ALPHABET) for _ in range(length)).encode("utf-8")
+        parts = MERGE_ENGINES["scan"](ranks, piece)
+        for name, merge in MERGE_ENGINES.items():
+            assert merge(ranks, piece) == parts, (name, piece)
+        expected = [ranks[piece[a[0]: b[0]]] for a, b in zip(parts, parts[1:])]
+        assert pair_ranks.merge(piece) == expected, piece
+
+
+@pytest.mark.parametrize("merge_engine", [*MERGE_ENGINES, "pair"])
+def test_encode_with_each_merge_engine(enc, merge_engine):
+    constructor = ENCODING_CONSTRUCTORS[enc.name]()
+    other = Encoding(**constructor, merge_engine=merge_engine, cache_size=0)
+    for text in texts(f"engine:{enc.name}"):
+        assert other.encode(text, allowed_special="all") == enc.encode(text, allowed_special="all")
+
+
+def test_stream_encoder_matches_encode(enc):
+    rng = random.Random(f"stream:{enc.name}")
+    for text in texts(f"stream:{enc.name}"):
+        expected = enc.encode(text, allowed_special="all")
+        stream = enc.stream_encoder(allowed_special="all")
+        tokens, pos = [], 0
+        while pos < len(text):
+            step = rng.randint(1, 20)
+            tokens += stream.feed(text[pos: pos + step])
+            pos += step
+        tokens += stream.finish()
+        assert tokens == expected, text
+
+
+def test_chunked_encode_matches_serial(enc):
+    with ThreadPoolExecutor(2) as pool:
+        for text in texts(f"chunked:{enc.name}", max_length=1000):
+            expected = enc.encode(text, allowed_special="all")
+            chunked = enc.encode(text, allowed_special="all", chunk_size=16, executor=pool)
+            assert chunked == expected, text
+
+
+def test_chunked_encode_in_worker_processes(enc):
+    text = "".join(texts(f"processes:{enc.name}", n=20, max_length=1000))
+    expected = enc.encode(text, allowed_special="all")
+    with ProcessPoolExecutor(2) as pool:
+        assert enc.encode(text, allowed_special="all", chunk_size=500, executor=pool) == expected
+    with enc.process_pool(2) as pool:
+        assert enc.encode(text, allowed_special="all", chunk_size=500, executor=pool) == expected
+
+
+def test_truncate_matches_slices_of_encode(enc):
+    for text in texts(f"truncate:{enc.name}"):
+        tokens = enc.encode(text, allowed_special="all")
+        for max_tokens in (0, 1, 3, 10, 1000):
+            head = enc.truncate(text, max_tokens, allowed_special="all")
+            assert head.tokens == tokens[:max_tokens]
+            assert head.text == text[head.start: head.end]
+            if max_tokens:
+                tail = enc.truncate(text, max_tokens, keep="end", allowed_special="all")
+                assert tail.tokens == tokens[-max_tokens:]
+                assert tail.text == text[tail.start: tail.end]
+
+
+def test_chunk_matches_slices_of_encode(enc):
+    for text in texts(f"chunk:{enc.name}"):
+        tokens = enc.encode(text, allowed_special="all")
+        for max_tokens, overlap in ((1, 0), (7, 0), (7, 3), (50, 10)):
+            stride = max_tokens - overlap
+            spans = list(enc.chunk(text, max_tokens, overlap=overlap, allowed_special="all"))
+            for i, span in enumerate(spans):
+                assert span.tokens == tokens[i * stride: i * stride + max_tokens]
+                assert span.text == text[span.start: span.end]
+            covered = [t for span in spans[:-1] for t in span.tokens[:stride]]
+            if spans:
+                covered += spans[-1].tokens
+            assert covered == tokens
+
+
+def test_offsets_match_decoded_token_bytes(enc):
+    for text in texts(f"offsets:{enc.name}"):
+        result = enc.encode_with_offsets(text, allowed_special="all")
+        assert result.tokens == enc.encode(text, allowed_special="all")
+        lengths = [len(enc._core_bpe.decode_bytes([token])) for token in result.tokens]
+        assert result.byte_offsets.tolist() == np.cumsum([0] + lengths)[:-1].tolist()
+        for byte_offset, char_offset in zip(result.byte_offsets, result.char_offsets):
+            # token 从字符 char_offset 的开头或中间开始
+            assert len(text[:char_offset].encode("utf-8")) <= byte_offset
+            assert byte_offset < len(text[:char_offset + 1].encode("utf-8"))
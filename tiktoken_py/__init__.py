@@ -1,2 +1,5 @@
 from .registry import get_encoding as get_encoding
+from .registry import list_encoding_names as list_encoding_names
+from .registry import preload_encodings as preload_encodings
+from .registry import evict_encoding as evict_encoding
 from .model import encoding_for_model as encoding_for_model
\ No newline at end of file
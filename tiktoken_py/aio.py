@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Sequence, TypeVar
+import asyncio
+import threading
+import weakref
+
+T = TypeVar("T")
+
+
+class Cancelled(Exception):
+    """Raised inside a worker thread when the coroutine that submitted the work was cancelled."""
+
+
+class AsyncRunner:
+    """Runs encoding work for coroutines without blocking the event loop.
+
+    Inputs up to `inline_threshold` (characters or tokens) run inline, since handing them to a
+    thread costs more than the work itself. Larger inputs run on a bounded thread pool of
+    `max_workers` threads, and at most `max_concurrency` of them are submitted at a time; further
+    callers wait, which applies backpressure instead of queueing unbounded work.
+
+    The work is split into segments and a cancelled coroutine stops its worker at the next segment
+    boundary, so cancelled requests do not keep occupying the pool.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_concurrency: Optional[int] = None,
+        inline_threshold: int = 2048,
+    ) -> None:
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency or max_workers
+        self.inline_threshold = inline_threshold
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # asyncio.Semaphore 只能在一个事件循环中使用，因此每个事件循环各自一个
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="tiktoken-py-async"
+                )
+            return self._executor
+
+    def _get_semaphore(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    async def run(
+        self,
+        size: int,
+        segments: Callable[[], Sequence[T]],
+        work: Callable[[T, list], None],
+        result: Callable[[list], object],
+    ):
+        """Runs `work(segment, out)` for every segment, then returns `result(out)`.
+
+        `segments` is called in the worker, so splitting the input does not block the loop either.
+        """
+        if size <= self.inline_threshold:
+            out: list = []
+            for segment in segments():
+                work(segment, out)
+            return result(out)
+
+        loop = asyncio.get_running_loop()
+        semaphore = self._get_semaphore(loop)
+        await semaphore.acquire()
+        cancelled = threading.Event()
+
+        def run_segments():
+            out: list = []
+            for segment in segments():
+                if cancelled.is_set():
+                    raise Cancelled()
+                work(segment, out)
+            return result(out)
+
+        def release(_):
+            # 工作线程真正结束之后才释放，取消的请求在停止之前仍然占用并发额度
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+                # 事件循环已经关闭
+                pass
+
+        try:
+            future = self._get_executor().submit(run_segments)
+        except BaseException:
+            semaphore.release()
+            raise
+        future.add_done_callback(release)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            cancelled.set()
+            future.cancel()
+            raise
@@ -3,7 +3,29 @@
 from copyreg import pickle
 import regex as re
 from itertools import islice, tee
+from array import array
+import functools
+import heapq
+import time
 import numpy as np
+from .cache import PieceCache
+from .pretokenize import PRETOKENIZERS, make_pretokenizer
+from .profiling import piece_length_bucket
+from .ranks import CompactRanks, vocab_digest
+from .token_index import TokenIndex
+
+# 长度不小于该值的片段在 byte_pair_merge 之前先检查是否存在可以合并的相邻字节，
+# 只在 token_index 已经构建或加载之后进行
+_MERGE_PRECHECK_MIN_LEN = 64
+
+# 不可合并的rank，即 np.iinfo(np.int32).max，只计算一次，避免在合并循环中反复调用 np.iinfo
+_MAX_RANK = int(np.iinfo(np.int32).max)
+
+# 少于该数量的token逐个查字典解码，向量化解码的固定开销（约 25us）在token较少时比逐个查询更慢
+_VECTORIZED_DECODE_MIN_TOKENS = 100
+
+# PairRanks.merge 对长度超过该值的片段使用最小堆，较短的片段线性扫描更快
+_PAIR_HEAP_MIN_LEN = 128
 
 
 def byte_pair_merge(ranks: dict[list, int], piece: int):
@@ -15,15 +37,15 @@ def byte_pair_merge(ranks: dict[list, int], piece: int):
 
     # 请注意，tiktoken 在对 ranks 进行索引时是对字节进行哈希处理，而不是对词对 tokens pair
     # 只要我们按照当前的方式进行BPE训练，这是等效的。打破这种等价关系的一个简单方法是解耦合并优先级与词索引，或者阻止特定的词合并。
-    min_rank = (np.iinfo(np.int32).max, np.iinfo(np.int32).max)
+    min_rank = (_MAX_RANK, _MAX_RANK)
     for i in range(0, len(piece) - 1):
-        rank = ranks.get(piece[i: i + 2], np.iinfo(np.int32).max)
+        rank = ranks.get(piece[i: i + 2], _MAX_RANK)
         if rank < min_rank[0]:
             min_rank = (rank, i)
         parts.append((i, rank))
     
-    parts.append((len(piece) - 1, np.iinfo(np.int32).max))
-    parts.append((len(piece), np.iinfo(np.int32).max))
+    parts.append((len(piece) - 1, _MAX_RANK))
+    parts.append((len(piece), _MAX_RANK))
     
     def get_rank(parts, i):
         # 用来服用 ranks和piece，不需要额外的通过参数形式传递到get_rank中
@@ -31,15 +53,15 @@ def byte_pair_merge(ranks: dict[list, int], piece: int):
         # 需要重新计算 (parts[i]parts[i+1], parts[i+2])的频率
         if i + 3 < len(parts):
             trigram = piece[parts[i][0]:parts[i+3][0]]
-            rank =  ranks.get(trigram, np.iinfo(np.int32).max)
+            rank =  ranks.get(trigram, _MAX_RANK)
             return rank 
         else:
-            return np.iinfo(np.int32).max
+            return _MAX_RANK
 
     # rank 表示频率的排名，rank 越小，表示该组合频率越高
     # 因此这里要找到rank最小的组合
     # 这里需要一直合并，直到没有需要合并的bigram为止
-    while min_rank[0] != np.iinfo(np.int32).max:
+    while min_rank[0] != _MAX_RANK:
         i = min_rank[1]
         if i > 0:
             # 获取合并之后的新的(left, i)的rank
@@ -53,7 +75,7 @@ def byte_pair_merge(ranks: dict[list, int], piece: int):
         del parts[i+1]  # 合并后面一个元素
 
         # 此时需要重新找一个min_rank，即找出频率最大的待合并的bi-gram
-        min_rank = (np.iinfo(np.int32).max, np.iinfo(np.int32).max)
+        min_rank = (_MAX_RANK, _MAX_RANK)
         for i, bigram in enumerate(parts):
             rank = bigram[1]
             # 更新最小的rank， 即频率最大的组合
@@ -62,97 +84,621 @@ def byte_pair_merge(ranks: dict[list, int], piece: int):
 
     return parts
 
-    
+
+def byte_pair_merge_heap(ranks: dict[bytes, int], piece: bytes):
+    """基于优先队列与双向链表的合并实现，输出与 byte_pair_merge 完全一致。
+
+    byte_pair_merge 每次合并之后都要重新扫描整个 parts 并执行 O(n) 的 del 操作，
+    对于很长的片段（base64、压缩后的JS等）是 O(n^2) 的。这里使用最小堆保存候选的
+    (rank, start)，使用链表维护词的边界，过期的rank采用延迟失效的方式在出堆时丢弃，
+    整体复杂度为 O(n log n)。
+    """
+    n = len(piece)
+    # 节点编号即该词的起始位置，节点 n 是结尾的哨兵
+    nxt = list(range(1, n + 2))
+    prv = list(range(-1, n))
+    alive = [True] * (n + 1)
+    rank = [_MAX_RANK] * (n + 1)
+    # version 用于延迟失效：每次重新计算某个节点的rank时递增，堆中版本不一致的元素直接丢弃
+    version = [0] * (n + 1)
+
+    heap = []
+    for i in range(n - 1):
+        r = ranks.get(piece[i: i + 2], _MAX_RANK)
+        rank[i] = r
+        if r != _MAX_RANK:
+            heap.append((r, i, 0))
+    heapq.heapify(heap)
+
+    def get_rank(i):
+        # 计算节点 i 与其后一个词合并后的rank，即 piece[i: nxt[nxt[i]]]
+        j = nxt[i]
+        if j > n:
+            return _MAX_RANK
+        k = nxt[j]
+        if k > n:
+            return _MAX_RANK
+        return ranks.get(piece[i:k], _MAX_RANK)
+
+    def update(i):
+        rank[i] = get_rank(i)
+        version[i] += 1
+        if rank[i] != _MAX_RANK:
+            heapq.heappush(heap, (rank[i], i, version[i]))
+
+    # 堆按 (rank, start) 排序，rank相同时取最左边的，与线性扫描时的 `<` 比较保持一致
+    while heap:
+        r, i, ver = heapq.heappop(heap)
+        if not alive[i] or ver != version[i]:
+            continue
+
+        # 合并 i 与 nxt[i]：删除节点 nxt[i]
+        j = nxt[i]
+        alive[j] = False
+        nxt[i] = nxt[j]
+        if nxt[j] <= n:
+            prv[nxt[j]] = i
+
+        update(i)
+        if prv[i] >= 0:
+            update(prv[i])
+
+    parts = []
+    i = 0
+    while i <= n:
+        parts.append((i, rank[i]))
+        i = nxt[i]
+    return parts
+
+
+class PairRanks:
+    """由词典预先计算的 (左token id, 右token id) -> 合并后token id 的表，合并完全在整数上进行。
+
+    byte_pair_merge 每次查询都要切出 piece[start:end] 生成新的 bytes 对象再计算哈希。
+    合并过程中每个部分都是词典中的token（初始的单字节都在词典中，合并结果也在词典中），
+    因此 piece[a:c] 是否可以合并只取决于 piece[a:b] 与 piece[b:c] 两个token的id：
+    对每个长度不小于2的token，枚举所有左右两半都在词典中的切分位置，记录两半的id对应的rank。
+    mergeable ranks 中token的id就是它的rank，合并后的id与rank相同。
+
+    只有全部 256 个单字节都在词典中时才能使用，见 `complete`。
+    """
+
+    def __init__(self, ranks) -> None:
+        start = time.perf_counter()
+        self.byte_ids = [ranks.get(bytes([b])) for b in range(256)]
+        self.complete = None not in self.byte_ids
+        # 键为 (left << 32) | right，整数键比元组更省内存，哈希也更快
+        pairs = {}
+        get = ranks.get
+        for token, rank in ranks.items() if self.complete else ():
+            for k in range(1, len(token)):
+                left = get(token[:k])
+                if left is None:
+                    continue
+                right = get(token[k:])
+                if right is not None:
+                    pairs[(left << 32) | right] = rank
+        self.pairs = pairs
+        self.build_seconds = time.perf_counter() - start
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def merge(self, piece: bytes) -> list[int]:
+        """对 piece 执行 bbpe，直接返回token id，结果与 byte_pair_merge 完全一致。"""
+        if len(piece) > _PAIR_HEAP_MIN_LEN:
+            return self._merge_heap(piece)
+        get = self.pairs.get
+        ids = [self.byte_ids[b] for b in piece]
+        # rank[i] 为 ids[i] 与 ids[i + 1] 合并后的rank
+        rank = [get((ids[i] << 32) | ids[i + 1], _MAX_RANK) for i in range(len(ids) - 1)]
+        while rank:
+            # min 与 index 都在 C 中执行；rank 相同时 index 返回最左边的位置，与 byte_pair_merge 一致
+            r = min(rank)
+            if r == _MAX_RANK:
+                break
+            i = rank.index(r)
+            ids[i] = r
+            del ids[i + 1]
+            del rank[i]
+            if i < len(rank):
+                rank[i] = get((r << 32) | ids[i + 1], _MAX_RANK)
+            if i > 0:
+                rank[i - 1] = get((ids[i - 1] << 32) | r, _MAX_RANK)
+        return ids
+
+    def _merge_heap(self, piece: bytes) -> list[int]:
+        # 长片段使用与 byte_pair_merge_heap 相同的最小堆 + 链表，避免 O(n^2) 的 min 与 del
+        get = self.pairs.get
+        ids = [self.byte_ids[b] for b in piece]
+        n = len(ids)
+        nxt = list(range(1, n + 1))
+        prv = list(range(-1, n - 1))
+        alive = [True] * n
+        version = [0] * n
+        heap = []
+        for i in range(n - 1):
+            r = get((ids[i] << 32) | ids[i + 1], _MAX_RANK)
+            if r != _MAX_RANK:
+                heap.append((r, i, 0))
+        heapq.heapify(heap)
+
+        def update(i):
+            version[i] += 1
+            j = nxt[i]
+            if j < n:
+                r = get((ids[i] << 32) | ids[j], _MAX_RANK)
+                if r != _MAX_RANK:
+                    heapq.heappush(heap, (r, i, version[i]))
+
+        while heap:
+            r, i, ver = heapq.heappop(heap)
+            if not alive[i] or ver != version[i]:
+                continue
+            j = nxt[i]
+            alive[j] = False
+            ids[i] = r
+            nxt[i] = nxt[j]
+            if nxt[j] < n:
+                prv[nxt[j]] = i
+            update(i)
+            if prv[i] >= 0:
+                update(prv[i])
+
+        tokens = []
+        i = 0
+        while i < n:
+            tokens.append(ids[i])
+            i = nxt[i]
+        return tokens
+
+
+@functools.lru_cache(maxsize=128)
+def tokens_overlap(tokens: frozenset[str]) -> bool:
+    """判断一组特殊符号之间是否可能重叠：某个符号包含另一个符号，或者某个符号的后缀是另一个符号的前缀。"""
+    for a in tokens:
+        for b in tokens:
+            if a != b and b in a:
+                return True
+            if any(b.startswith(a[i:]) for i in range(1, len(a))):
+                return True
+    return False
+
+
+@functools.lru_cache(maxsize=128)
+def _special_regex(tokens: tuple[str, ...]):
+    # 按符号集合缓存编译好的特殊符号正则，避免每次调用都重新编译
+    return re.compile("|".join(re.escape(token) for token in tokens))
+
+
+MERGE_ENGINES = {
+    "scan": byte_pair_merge,
+    "heap": byte_pair_merge_heap,
+}
+
+
 class CoreBPE:
     def __init__(self,
                  encoder: dict[bytes, int]=None,
                  special_tokens_encoder: dict[int, int]=None,
                  pattern: str=None,
+                 merge_engine: str="scan",
+                 cache_size: int=4096,
+                 cache_bytes: int=1 << 20,
+                 pretokenizer: str="regex",
                 ) -> None:
+        if merge_engine not in MERGE_ENGINES and merge_engine != "pair":
+            raise ValueError(
+                f"Unknown merge engine {merge_engine}. "
+                f"Available engines: {[*MERGE_ENGINES, 'pair']}"
+            )
+        if pretokenizer not in PRETOKENIZERS:
+            raise ValueError(
+                f"Unknown pre-tokenizer {pretokenizer}. Available: {list(PRETOKENIZERS)}"
+            )
         self.encoder = encoder
         self.special_tokens_encoder = special_tokens_encoder
         self.pattern = pattern
-        
+        # 选择 bbpe 的合并实现，便于线上对比 "scan"、"heap" 与 "pair" 几种实现。
+        # "pair" 使用 PairRanks 在token id上合并，词典缺少单字节token时退回到 "heap"
+        self.merge_engine = merge_engine
+        self._byte_pair_merge = MERGE_ENGINES.get(merge_engine, byte_pair_merge_heap)
+        # 正则切分的实现，"fast" 对内置编码的 ASCII 文本使用更简单的等价正则，见 pretokenize
+        self.pretokenizer = pretokenizer
+        # 缓存不在词典中的片段的 bbpe 结果，cache_size 为 0 时关闭
+        self.piece_cache = PieceCache(cache_size, cache_bytes)
+        # 性能统计，为 None 时关闭，见 profiling.EncodeProfiler
+        self.profiler = None
+
+    # 以下结构都在第一次使用时才构建，只做 encode 的进程不需要 decoder 与 sorted_token_bytes，
+    # 可以缩短首个token的耗时并减少常驻内存。fork 之前可以调用 warmup() 提前全部构建好。
+    # 多个线程同时首次访问时可能会重复构建，但结果相同，不影响正确性。
+    @functools.cached_property
+    def regex_tls(self):
         # 构建匹配正则表达式
-        self.regex_tls = re.compile(pattern)
-        
+        return re.compile(self.pattern)
+
+    @functools.cached_property
+    def pretokenizer_tls(self):
+        # 编码时使用的切分器，与 regex_tls.finditer 的结果完全一致
+        return make_pretokenizer(self.pretokenizer, self.pattern)
+
+    @functools.cached_property
+    def special_regex_tls(self):
         # 构建特殊符号匹配正则表达式
-        escaped_parts = [re.escape(key) for key in special_tokens_encoder.keys()]
+        escaped_parts = [re.escape(key) for key in self.special_tokens_encoder.keys()]
         pattern = '|'.join(escaped_parts)
         try:
-            special_regex = re.compile(pattern)
+            return re.compile(pattern)
         except re.error:
             raise ValueError(f'Invalid pattern: {pattern}')
-        self.special_regex_tls = special_regex
 
-        # 构建反tokenizer的模块
-        self.decoder  = {v: k for k, v in self.encoder.items()}
-        self.special_tokens_decoder = {v: k for k, v in self.special_tokens_encoder.items()}
+    @functools.cached_property
+    def special_tokens_overlap(self):
+        # 特殊符号不重叠时（例如所有 <|...|> 形式的符号），只需要扫描一遍就能找出所有特殊符号的位置；
+        # 重叠时退回到逐个位置重新搜索的方式
+        return tokens_overlap(frozenset(self.special_tokens_encoder))
+
+    @functools.cached_property
+    def decoder(self):
+        # 构建反tokenizer的模块，CompactRanks 直接按 rank 索引自身的数组，不需要再构建一个字典
+        if isinstance(self.encoder, CompactRanks):
+            return self.encoder.decoder
+        return {v: k for k, v in self.encoder.items()}
+
+    @functools.cached_property
+    def special_tokens_decoder(self):
+        # 特殊符号以字符串保存，解码时需要与普通token一样拼接为字节
+        return {v: k.encode('utf-8') for k, v in self.special_tokens_encoder.items()}
 
+    @functools.cached_property
+    def sorted_token_bytes(self):
         # 获取排序后的符号
-        self.sorted_token_bytes = sorted(self.encoder.keys())
+        return sorted(self.encoder.keys())
+
+    @functools.cached_property
+    def _decode_table(self):
+        # 向量化解码使用的表：所有token的字节按 token id 顺序拼接为一个连续的 blob，
+        # offsets[i]: offsets[i+1] 即 token i 的字节，不存在的 token id 长度为 0
+        if isinstance(self.encoder, CompactRanks) and self.encoder.dense:
+            table = self._compact_decode_table()
+            if table is not None:
+                return table
+        decoders = (self.decoder, self.special_tokens_decoder)
+        n = max(max(d, default=-1) for d in decoders) + 1
+        lengths = np.zeros(n, dtype=np.int64)
+        for d in decoders:
+            for token, token_bytes in d.items():
+                lengths[token] = len(token_bytes)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        blob = bytearray(int(offsets[-1]))
+        for d in decoders:
+            for token, token_bytes in d.items():
+                blob[offsets[token]: offsets[token + 1]] = token_bytes
+        return np.frombuffer(bytes(blob), dtype=np.uint8), offsets
+
+    def _compact_decode_table(self):
+        # CompactRanks 的 blob 已经按 token id 顺序拼接，只需要在后面追加特殊符号，
+        # 不需要为每个token创建 bytes 对象；特殊符号的 id 不全在普通token之后时返回 None
+        n = len(self.encoder)
+        specials = sorted(self.special_tokens_decoder.items())
+        if specials and specials[0][0] < n:
+            return None
+        blob, token_offsets = self.encoder.buffers()
+        total = max(n, specials[-1][0] + 1 if specials else 0)
+        lengths = np.zeros(total, dtype=np.int64)
+        lengths[:n] = np.diff(np.frombuffer(token_offsets, dtype=np.uint32))
+        for token, token_bytes in specials:
+            lengths[token] = len(token_bytes)
+        offsets = np.zeros(total + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        special_blob = b"".join(token_bytes for _, token_bytes in specials)
+        blob = np.concatenate([
+            np.frombuffer(blob, dtype=np.uint8), np.frombuffer(special_blob, dtype=np.uint8)
+        ])
+        return blob, offsets
+
+    @functools.cached_property
+    def pair_ranks(self):
+        # (左token id, 右token id) -> 合并后token id 的表，只有 "pair" 引擎使用，不能使用时为 None
+        pair_ranks = PairRanks(self.encoder)
+        return pair_ranks if pair_ranks.complete else None
+
+    @functools.cached_property
+    def token_index(self):
+        # 基于 sorted_token_bytes 构建的前缀索引，用于前缀查询；已经存在时也用于跳过无法合并的片段
+        return TokenIndex.build(self.sorted_token_bytes, self.encoder)
+
+    @functools.cached_property
+    def vocab_digest(self):
+        # 词表的 sha256，用来确认加载的索引属于当前词表，见 ranks.vocab_digest
+        return vocab_digest(self.encoder)
+
+    def load_token_index(self, path: str):
+        """从 TokenIndex.save 写出的文件加载索引，跳过排序与构建。
 
-    def encode(self, text: str, allowed_special: set[str]):
-        return self._encode_native(text, allowed_special)
+        索引记录了构建时词表的摘要，与当前词表不一致时抛出 ValueError：大小相同的其他词表的索引
+        会给出错误的前缀查询结果，并错误地跳过 byte_pair_merge。
+        """
+        index = TokenIndex.load(path)
+        if index.vocab_digest != self.vocab_digest:
+            raise ValueError(f"Token index {path} was built for a different vocabulary")
+        self.token_index = index
+        return index
+
+    def warmup(self):
+        """提前构建所有延迟初始化的结构，例如在 fork 子进程之前调用。"""
+        self.regex_tls
+        self.pretokenizer_tls
+        self.special_regex_tls
+        self.special_tokens_overlap
+        self.decoder
+        self.special_tokens_decoder
+        if not isinstance(self.encoder, CompactRanks):
+            # CompactRanks 不为每个token创建 bytes 对象，sorted_token_bytes 只在需要时构建
+            self.sorted_token_bytes
+        self._decode_table
+        if self.merge_engine == "pair":
+            self.pair_ranks
+        return self
+
+    def encode(self, text: str, allowed_special: set[str], special_spans: list=None, out=None):
+        # out 为追加token的容器，默认为新的列表；也可以传入 array("I") 等支持 append/extend 的缓冲区
+        if self.profiler is not None:
+            return self._encode_profiled(text, allowed_special, special_spans, out)
+        return self._encode_native(text, allowed_special, special_spans, out)
+
+    def special_spans(self, text: str, allowed_special: set[str]) -> list[tuple[int, int]]:
+        """找出 text 中所有允许的特殊符号的位置 (start, end)，按出现顺序排列。"""
+        if not allowed_special or not self.special_tokens_encoder:
+            return []
+        if not self.special_tokens_overlap:
+            # 只包含允许的符号的正则按集合缓存，一次 finditer 即可找出所有位置
+            allowed = tuple(t for t in self.special_tokens_encoder if t in allowed_special)
+            if not allowed:
+                return []
+            return [m.span() for m in _special_regex(allowed).finditer(text)]
 
-    def _encode_native(self, text, allowed_special):
         special_regex = self.special_regex_tls
-        regex_tls = self.regex_tls
-        ret = []
-        start = 0
-        last_piece_token_len = 0
+        spans = []
+        start_find = 0
         while True:
-            next_special = None 
-            start_find = start
-
-            # 找到第一个特殊符号，并记录其位置
-            # 特殊符号之前的内容是有效的prompt输入
-            while True:
-                # 匹配是否命中了词典中的符号
-                match = special_regex.search(text, start_find)
-                if not match:
-                    break
-                special_token = match.group(0)
-                if special_token in allowed_special:
-                    next_special = match
-                    break
+            # 匹配是否命中了词典中的符号，不允许的符号跳过一个字符后重新搜索
+            match = special_regex.search(text, start_find)
+            if not match:
+                break
+            if match.group(0) in allowed_special:
+                spans.append(match.span())
+                start_find = match.end()
+            else:
                 start_find = match.start() + 1
-            
+        return spans
+
+    def _encode_native(self, text, allowed_special, special_spans=None, out=None):
+        pretokenizer = self.pretokenizer_tls
+        encoder = self.encoder
+        if special_spans is None:
+            special_spans = self.special_spans(text, allowed_special)
+        ret = [] if out is None else out
+        start = 0
+        last_piece_token_len = 0
+        # 特殊符号之前的内容是有效的prompt输入，最后追加一个哨兵处理最后一个特殊符号之后的内容
+        for next_special in [*special_spans, None]:
             # 匹配词典中的符号，找到真正有效的prompt输入之后确定end位置
-            end = len(text) if not next_special else next_special.start()
-            for match in regex_tls.finditer(text[start:end]):
+            end = len(text) if not next_special else next_special[0]
+            for match in pretokenizer.finditer(text[start:end]):
                 
                 # 匹配词典中的符号，直接记录词典中的id
+                # 只查询一次，CompactRanks 的每次查询都比字典更慢
                 piece = match.group(0).encode('utf-8')
-                if piece in self.encoder:
+                token = encoder.get(piece)
+                if token is not None:
                     last_piece_token_len = 1
-                    ret.append(self.encoder[piece])
+                    ret.append(token)
                     continue
                 
                 # 如果没有匹配到词典中的内容，将该token转换为bytes字节数据，使用bbpe算法进行拆分
                 # tokens 是字节编码列表，通过extend接口附加在ret的后面
-                tokens = self.bype_pair_encode(piece, self.encoder)
+                tokens = self._encode_piece(piece)
                 last_piece_token_len = len(tokens)
                 ret.extend(tokens)
 
             # 匹配到特殊符号，需要将特殊符号转好到对应的id
             if next_special:
-                token = self.special_tokens_encoder[next_special.group(0)]
+                token = self.special_tokens_encoder[text[next_special[0]:next_special[1]]]
                 ret.append(token)
 
                 # 特殊符号后面的有效输入，需要重新开始匹配
-                start = next_special.end()
+                start = next_special[1]
                 last_piece_token_len = 0
-            else:
-                break
         # last_piece_token_len is how many tokens came from the last regex split. This is used
         # for determining unstable tokens, since you can't merge across (stable) regex splits
         # last_piece_token_len 记录了最后一个匹配到的片段的长度
         return ret, last_piece_token_len
 
+    def encode_pieces(self, text: str, allowed_special: set[str], special_spans: list=None):
+        """按顺序逐个产生 (start, end, tokens)：每个正则片段或特殊符号在 text 中的字符位置及其token。
+
+        拼接所有的 tokens 即 encode 的结果。这是一个生成器，调用方停止迭代时编码也随之停止。
+        """
+        pretokenizer = self.pretokenizer_tls
+        encoder = self.encoder
+        if special_spans is None:
+            special_spans = self.special_spans(text, allowed_special)
+        start = 0
+        for next_special in [*special_spans, None]:
+            end = len(text) if not next_special else next_special[0]
+            for match in pretokenizer.finditer(text[start:end]):
+                piece = match.group(0).encode('utf-8')
+                token = encoder.get(piece)
+                if token is not None:
+                    tokens = (token,)
+                else:
+                    tokens = self._encode_piece(piece)
+                yield start + match.start(), start + match.end(), tokens
+
+            if next_special:
+                token = self.special_tokens_encoder[text[next_special[0]:next_special[1]]]
+                yield next_special[0], next_special[1], (token,)
+                start = next_special[1]
+
+    def _encode_profiled(self, text, allowed_special, special_spans=None, out=None):
+        # 与 _encode_native 的逻辑相同，额外记录各个阶段的耗时与片段统计。
+        # 单独实现一份，关闭统计时 _encode_native 没有任何额外开销
+        profiler = self.profiler
+        clock = time.perf_counter
+        call = profiler.new_call()
+        histogram = call["piece_lengths"]
+        if special_spans is None:
+            begin = clock()
+            special_spans = self.special_spans(text, allowed_special)
+            call["special_scan_seconds"] += clock() - begin
+        # 扫描时间已经计入 special_scan_seconds，total_seconds 从这里开始计时，避免重复计算
+        begin = clock()
+
+        pretokenizer = self.pretokenizer_tls
+        encoder = self.encoder
+        cache = self.piece_cache
+        ret = [] if out is None else out
+        start = 0
+        last_piece_token_len = 0
+        split_seconds = lookup_seconds = merge_seconds = 0.0
+        for next_special in [*special_spans, None]:
+            end = len(text) if not next_special else next_special[0]
+            matches = pretokenizer.finditer(text[start:end])
+            while True:
+                t0 = clock()
+                match = next(matches, None)
+                t1 = clock()
+                split_seconds += t1 - t0
+                if match is None:
+                    break
+
+                piece = match.group(0).encode('utf-8')
+                bucket = piece_length_bucket(len(piece))
+                histogram[bucket] = histogram.get(bucket, 0) + 1
+                call["bytes"] += len(piece)
+                token = encoder.get(piece)
+                if token is not None:
+                    last_piece_token_len = 1
+                    ret.append(token)
+                    lookup_seconds += clock() - t1
+                    call["direct_hits"] += 1
+                    continue
+
+                # 与 _encode_piece 相同，但区分缓存命中与真正执行的合并：缓存命中计为查询
+                tokens = cache.get(piece) if cache.enabled else None
+                if tokens is not None:
+                    lookup_seconds += clock() - t1
+                    call["cache_hits"] += 1
+                else:
+                    tokens = self.bype_pair_encode(piece, encoder)
+                    if cache.enabled:
+                        tokens = tuple(tokens)
+                        cache.put(piece, tokens)
+                    merge_seconds += clock() - t1
+                    call["merged_pieces"] += 1
+                    # 每次合并减少一个部分，从单个字节合并到最终的token需要 len(piece) - len(tokens) 次
+                    call["merge_iterations"] += len(piece) - len(tokens)
+                last_piece_token_len = len(tokens)
+                ret.extend(tokens)
+
+            if next_special:
+                token = self.special_tokens_encoder[text[next_special[0]:next_special[1]]]
+                ret.append(token)
+                call["special_tokens"] += 1
+                call["bytes"] += len(text[next_special[0]:next_special[1]].encode('utf-8'))
+                start = next_special[1]
+                last_piece_token_len = 0
+
+        call["pieces"] = call["direct_hits"] + call["cache_hits"] + call["merged_pieces"]
+        call["tokens"] = len(ret)
+        call["split_seconds"] = split_seconds
+        call["lookup_seconds"] = lookup_seconds
+        call["merge_seconds"] = merge_seconds
+        call["total_seconds"] = call["special_scan_seconds"] + clock() - begin
+        profiler.record(call)
+        return ret, last_piece_token_len
+
+    def count(self, text: str, allowed_special: set[str], limit: int=None,
+              special_spans: list=None) -> int:
+        return self._count_native(text, allowed_special, limit, special_spans)
+
+    def _count_native(self, text, allowed_special, limit, special_spans=None):
+        # 与 _encode_native 的切分逻辑相同，但只统计token数量，不生成token列表：
+        # 词典命中只需要一次字典查询，其余片段只需要 byte_pair_merge 之后的边界数量
+        # 设置 limit 时，数量超过 limit 后立即返回
+        pretokenizer = self.pretokenizer_tls
+        encoder = self.encoder
+        cache = self.piece_cache
+        if special_spans is None:
+            special_spans = self.special_spans(text, allowed_special)
+        # 本次调用中已经合并过的片段的token数量，重复出现的片段不需要再次合并
+        counts = {}
+        count = 0
+        start = 0
+        for next_special in [*special_spans, None]:
+            end = len(text) if not next_special else next_special[0]
+            for match in pretokenizer.finditer(text[start:end]):
+                piece = match.group(0).encode('utf-8')
+                if piece in encoder:
+                    count += 1
+                else:
+                    # 只读取 encode 写入的缓存，不计入命中率统计；未命中时只统计合并之后的边界数量，
+                    # 不生成token列表
+                    n = counts.get(piece)
+                    if n is None:
+                        tokens = cache.peek(piece) if cache.enabled else None
+                        n = len(tokens) if tokens is not None else self._merge_count(piece)
+                        counts[piece] = n
+                    count += n
+                if limit is not None and count > limit:
+                    return count
+
+            if next_special:
+                count += 1
+                if limit is not None and count > limit:
+                    return count
+                start = next_special[1]
+        return count
+
+    def _merge_count(self, piece):
+        # 片段经过 bbpe 之后的token数量
+        if self.merge_engine == "pair" and self.pair_ranks is not None:
+            return len(self.pair_ranks.merge(piece))
+        return len(self._byte_pair_merge(self.encoder, piece)) - 1
+
+    def encode_piece(self, piece: bytes) -> list[int]:
+        # 编码单个正则切分出的片段
+        token = self.encoder.get(piece)
+        if token is not None:
+            return [token]
+        return list(self._encode_piece(piece))
+
+    def _encode_piece(self, piece):
+        # 先查询缓存，未命中时再执行 bbpe 并写回缓存
+        cache = self.piece_cache
+        if not cache.enabled:
+            return self.bype_pair_encode(piece, self.encoder)
+        tokens = cache.get(piece)
+        if tokens is None:
+            tokens = tuple(self.bype_pair_encode(piece, self.encoder))
+            cache.put(piece, tokens)
+        return tokens
+
     def bype_pair_encode(self, piece, ranks):
         assert len(piece) > 1
-        pairs =  byte_pair_merge(ranks, piece)
+        # 较长的片段先用索引判断是否存在可以合并的相邻字节，不存在时每个字节就是一个token，
+        # 不需要执行 byte_pair_merge。索引需要对整个词典排序，encode 不会为此构建索引，
+        # 只使用已经构建（tokens_with_prefix）或加载（load_token_index）的索引
+        if len(piece) >= _MERGE_PRECHECK_MIN_LEN and ranks is self.encoder:
+            index = self.__dict__.get("token_index")
+            if index is not None and not index.can_merge(piece):
+                return [ranks[piece[i: i + 1]] for i in range(len(piece))]
+        if self.merge_engine == "pair" and ranks is self.encoder and self.pair_ranks is not None:
+            return self.pair_ranks.merge(piece)
+        pairs = self._byte_pair_merge(ranks, piece)
         tokens = []
         for idx in range(len(pairs) - 1):
             start, end = pairs[idx][0], pairs[idx + 1][0]
@@ -174,7 +720,28 @@ class CoreBPE:
 
         return ret
 
+    def _decode_vectorized(self, tokens):
+        # 对 numpy 数组等连续缓冲区，使用 _decode_table 一次性完成所有token的查表与拼接
+        blob, offsets = self._decode_table
+        ids = np.asarray(tokens).astype(np.int64, copy=False).ravel()
+        # 与 _decode_native 一致，未知的 token id 直接跳过
+        ids = ids[(ids >= 0) & (ids < len(offsets) - 1)]
+        starts = offsets[ids]
+        lengths = offsets[ids + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return b""
+        # 对输出的每个字节计算其在 blob 中的位置：所属token的起始位置 + 在token内的偏移
+        ends = np.cumsum(lengths)
+        index = np.arange(total, dtype=np.int64) + np.repeat(starts - (ends - lengths), lengths)
+        return blob[index].tobytes()
+
     def decode_bytes(self, tokens):
+        if isinstance(tokens, (np.ndarray, memoryview, array)):
+            tokens = np.asarray(tokens).ravel()
+            if len(tokens) >= _VECTORIZED_DECODE_MIN_TOKENS:
+                return self._decode_vectorized(tokens)
+            tokens = tokens.tolist()
         return self._decode_native(tokens)
 
         
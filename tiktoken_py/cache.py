@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+import os
+import struct
+import threading
+
+# 快照格式的版本号，格式变化时需要递增
+_SNAPSHOT_VERSION = 2
+# 快照格式，全部为小端序，只包含数据，加载时不会执行任何代码：
+#   header: magic(4) | version(u32) | fingerprint(32) | n_entries(u32)
+#   entry:  piece_len(u32) | n_tokens(u32) | piece | tokens u32[n_tokens]，按 LRU 顺序排列
+_SNAPSHOT_MAGIC = b"TKPC"
+_SNAPSHOT_HEADER = struct.Struct("<4sI32sI")
+_SNAPSHOT_ENTRY = struct.Struct("<II")
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    currsize: int
+    currbytes: int
+    maxsize: int
+    maxbytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class PieceCache:
+    """线程安全的 piece -> tokens LRU 缓存。
+
+    缓存 bype_pair_encode 的结果，容量同时受条目数 maxsize 与 key 的总字节数 maxbytes 限制，
+    任何一个超限都会淘汰最久未使用的条目。maxsize 为 0 时缓存关闭。
+    """
+
+    def __init__(self, maxsize: int = 4096, maxbytes: int = 1 << 20) -> None:
+        if maxsize < 0 or maxbytes < 0:
+            raise ValueError("Cache capacity must be non-negative")
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._data: "OrderedDict[bytes, tuple[int, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.maxbytes > 0
+
+    def get(self, piece: bytes) -> Optional[tuple[int, ...]]:
+        with self._lock:
+            tokens = self._data.get(piece)
+            if tokens is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(piece)
+            self.hits += 1
+            return tokens
+
+    def peek(self, piece: bytes) -> Optional[tuple[int, ...]]:
+        """与 get 相同，但不计入命中与未命中的统计，供 count_tokens 使用，未命中时也不会写回。"""
+        with self._lock:
+            tokens = self._data.get(piece)
+            if tokens is not None:
+                self._data.move_to_end(piece)
+            return tokens
+
+    def put(self, piece: bytes, tokens: tuple[int, ...]) -> None:
+        if len(piece) > self.maxbytes:
+            return
+        with self._lock:
+            if piece in self._data:
+                self._data.move_to_end(piece)
+                return
+            self._data[piece] = tokens
+            self._bytes += len(piece)
+            while len(self._data) > self.maxsize or self._bytes > self.maxbytes:
+                old, _ = self._data.popitem(last=False)
+                self._bytes -= len(old)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                self.hits, self.misses, self.evictions,
+                len(self._data), self._bytes, self.maxsize, self.maxbytes,
+            )
+
+    def save(self, path: str, fingerprint: bytes) -> None:
+        """将缓存条目按 LRU 顺序写入磁盘快照，先写临时文件再原子替换。
+
+        fingerprint 标识编码与词表（见 Encoding._cache_fingerprint），加载时用来确认快照属于同一个词表。
+        """
+        with self._lock:
+            entries = list(self._data.items())
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_SNAPSHOT_HEADER.pack(
+                _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, fingerprint, len(entries)
+            ))
+            for piece, tokens in entries:
+                f.write(_SNAPSHOT_ENTRY.pack(len(piece), len(tokens)))
+                f.write(piece)
+                f.write(struct.pack(f"<{len(tokens)}I", *tokens))
+        os.replace(tmp_path, path)
+
+    def load(self, path: str, fingerprint: bytes) -> int:
+        """从磁盘快照恢复缓存条目，返回加载的条目数。
+
+        快照格式不正确或者与当前词表不匹配时抛出 ValueError。快照只包含数据，不会执行任何代码。
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < _SNAPSHOT_HEADER.size:
+            raise ValueError(f"{path} is not a cache snapshot")
+        magic, version, snapshot_fingerprint, n = _SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a cache snapshot")
+        if version != _SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported cache snapshot version {version} in {path}")
+        if snapshot_fingerprint != fingerprint:
+            raise ValueError(f"Cache snapshot {path} was written for a different vocabulary")
+        entries = []
+        pos = _SNAPSHOT_HEADER.size
+        try:
+            for _ in range(n):
+                piece_len, n_tokens = _SNAPSHOT_ENTRY.unpack_from(data, pos)
+                pos += _SNAPSHOT_ENTRY.size
+                piece = data[pos: pos + piece_len]
+                pos += piece_len
+                tokens = struct.unpack_from(f"<{n_tokens}I", data, pos)
+                pos += 4 * n_tokens
+                if len(piece) != piece_len:
+                    raise struct.error("truncated piece")
+                entries.append((piece, tokens))
+        except struct.error:
+            raise ValueError(f"Cache snapshot {path} is truncated or corrupted") from None
+        if pos != len(data):
+            raise ValueError(f"Cache snapshot {path} is truncated or corrupted")
+        for piece, tokens in entries:
+            self.put(piece, tokens)
+        return len(entries)
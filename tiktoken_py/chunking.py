@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from bisect import bisect_right
+from collections import deque
+from typing import TYPE_CHECKING, AbstractSet, Iterator, NamedTuple, Optional
+from .offsets import fix_surrogates, token_offsets
+from .split import SAFE_SPLIT_PATTERNS, _prev_safe_split
+
+if TYPE_CHECKING:
+    from .core import Encoding
+
+
+class TokenSpan(NamedTuple):
+    """A run of consecutive tokens of a text, with the characters they cover.
+
+    `start` and `end` are character offsets into the encoded text and `text` is
+    `text[start:end]`. They cover every byte of the tokens: if a character is split between two
+    tokens, it belongs to both, so neighbouring spans cut at that token share the character.
+    """
+
+    text: str
+    tokens: list[int]
+    start: int
+    end: int
+
+
+def _span(text: str, items) -> TokenSpan:
+    # items 为 token_offsets 产生的 (token, byte_start, char_start, char_end)
+    start, end = items[0][2], items[-1][3]
+    return TokenSpan(text[start:end], [item[0] for item in items], start, end)
+
+
+def _in_special(special_spans: list, starts: list, pos: int) -> bool:
+    i = bisect_right(starts, pos) - 1
+    return i >= 0 and special_spans[i][0] < pos < special_spans[i][1]
+
+
+def truncate(
+    encoding: "Encoding",
+    text: str,
+    max_tokens: int,
+    keep: str,
+    allowed_special: AbstractSet[str],
+    disallowed_special: AbstractSet[str],
+) -> TokenSpan:
+    text = fix_surrogates(text)
+    special_spans = encoding._scan_special(text, allowed_special, disallowed_special)
+    if max_tokens == 0:
+        pos = 0 if keep == "start" else len(text)
+        return TokenSpan("", [], pos, pos)
+
+    if keep == "start":
+        items = []
+        for item in token_offsets(encoding._core_bpe, text, allowed_special, special_spans):
+            items.append(item)
+            if len(items) == max_tokens:
+                break
+        return _span(text, items) if items else TokenSpan("", [], 0, 0)
+
+    # keep == "end": encode only a tail of the text, starting at a position that is a piece
+    # boundary whatever precedes it, and move it back until the tail has enough tokens
+    if special_spans is None:
+        special_spans = encoding._core_bpe.special_spans(text, allowed_special)
+    starts = [start for start, _ in special_spans]
+    safe = encoding._pat_str in SAFE_SPLIT_PATTERNS
+    distance = max(4 * max_tokens, 256)
+    while True:
+        pos = 0
+        if safe and distance < len(text):
+            pos = _prev_safe_split(text, len(text) - distance)
+            while pos is not None and _in_special(special_spans, starts, pos):
+                pos = _prev_safe_split(text, pos - 1)
+            pos = pos or 0
+        items = deque(
+            token_offsets(encoding._core_bpe, text, allowed_special, special_spans, pos),
+            maxlen=max_tokens,
+        )
+        if len(items) == max_tokens or pos == 0:
+            break
+        distance = 2 * (len(text) - pos)
+    return _span(text, items) if items else TokenSpan("", [], len(text), len(text))
+
+
+def chunk(
+    encoding: "Encoding",
+    text: str,
+    max_tokens: int,
+    overlap: int,
+    allowed_special: AbstractSet[str],
+    special_spans: Optional[list],
+) -> Iterator[TokenSpan]:
+    # Windows start every max_tokens - overlap tokens; the last one holds the remaining tokens.
+    # Only the current window is kept in memory and no text is encoded twice.
+    stride = max_tokens - overlap
+    window = []
+    emitted = False
+    for item in token_offsets(encoding._core_bpe, text, allowed_special, special_spans):
+        window.append(item)
+        if len(window) == max_tokens:
+            yield _span(text, window)
+            emitted = True
+            del window[:stride]
+    if window and (len(window) > overlap or not emitted):
+        yield _span(text, window)
@@ -1,9 +1,30 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-from typing import AbstractSet, Collection, Literal, NoReturn, Optional, Union
-from .bbpe import CoreBPE
+from typing import (
+    AbstractSet, Callable, Collection, Iterable, Iterator, Literal, NoReturn, Optional, Union
+)
+from .aio import AsyncRunner
+from .bbpe import CoreBPE, tokens_overlap
+from .cache import CacheInfo
+from .chunking import TokenSpan, chunk, truncate
+from .offsets import TokenOffsets, encode_with_offsets, fix_surrogates
+from .profiling import EncodeProfiler
+from .ranks import CompactRanks
+from .split import SAFE_SPLIT_PATTERNS, safe_split_points
+from .streaming import StreamingDecoder, StreamingEncoder, encode_stream
+import numpy as np
+from array import array
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 import functools
+import hashlib
+import os
+import threading
+import time
 import regex
+# array typecode of 32-bit unsigned ints, for encode_to_numpy
+_UINT32 = "I" if array("I").itemsize == 4 else "L"
+
+
 class Encoding:
     def __init__(self,
                 name: str,
@@ -12,6 +33,11 @@ class Encoding:
                 mergeable_ranks: dict[bytes, int],
                 special_tokens: dict[str, int],
                 explicit_n_vocab: Optional[int] = None,
+                merge_engine: str = "scan",
+                cache_size: int = 4096,
+                cache_bytes: int = 1 << 20,
+                compact_ranks: bool = False,
+                pretokenizer: str = "regex",
             ) -> None:
         """Creates an Encoding object.
 
@@ -27,12 +53,38 @@ class Encoding:
             special_tokens: A dictionary mapping special token strings to their token values.
             explicit_n_vocab: The number of tokens in the vocabulary. If provided, it is checked
                 that the number of mergeable tokens and special tokens is equal to this number.
+            merge_engine: The byte pair merge implementation used by the core BPE: "scan" (the
+                original linear rescan), "heap" (priority queue, O(n log n)) or "pair" (merges
+                token ids using a precomputed (left id, right id) -> merged id table, built on
+                first use). All produce identical tokens.
+            cache_size: The maximum number of entries in the per-piece LRU encode cache. Set to 0
+                to disable the cache.
+            cache_bytes: The maximum total size in bytes of the pieces held by the cache.
+            compact_ranks: Store `mergeable_ranks` as a `CompactRanks` (flat arrays and a hash
+                table) instead of a dict, and decode from the same arrays. This uses a fraction of
+                the memory of the dict and its reverse dict, at the cost of slower lookups.
+            pretokenizer: How the text is split with `pat_str`: "regex" (the `regex` module) or
+                "fast", which matches ASCII text of the bundled encodings with an equivalent
+                standard library pattern and falls back to "regex" elsewhere. Both produce
+                identical pieces, see `FastPreTokenizer`.
         """
         self.name = name
 
+        if compact_ranks and not isinstance(mergeable_ranks, CompactRanks):
+            mergeable_ranks = CompactRanks.from_items(mergeable_ranks.items())
         self._pat_str = pat_str
         self._mergeable_ranks = mergeable_ranks
         self._special_tokens = special_tokens
+        self._explicit_n_vocab = explicit_n_vocab
+        self._merge_engine = merge_engine
+        self._cache_size = cache_size
+        self._cache_bytes = cache_bytes
+        self._compact_ranks = compact_ranks
+        self._pretokenizer = pretokenizer
+        # Worker pools of encode(num_workers=...) by worker count, see _worker_pool
+        self._pools: dict[int, ProcessPoolExecutor] = {}
+        self._pools_pid = os.getpid()
+        self._pools_lock = threading.Lock()
 
         self.max_token_value = max(
             max(mergeable_ranks.values()), max(special_tokens.values(), default=0)
@@ -44,8 +96,104 @@ class Encoding:
         self._core_bpe = CoreBPE(encoder=self._mergeable_ranks,
                                 special_tokens_encoder=self._special_tokens,
                                 pattern=self._pat_str,
+                                merge_engine=merge_engine,
+                                cache_size=cache_size,
+                                cache_bytes=cache_bytes,
+                                pretokenizer=pretokenizer,
                             )
 
+    def __repr__(self) -> str:
+        return f"<Encoding {self.name!r}>"
+
+    def __getstate__(self) -> object:
+        import tiktoken_py.registry
+
+        # As an optimisation, pickle registered encodings by reference
+        if self is tiktoken_py.registry.ENCODINGS.get(self.name):
+            return self.name
+        return {
+            "name": self.name,
+            "pat_str": self._pat_str,
+            "mergeable_ranks": self._mergeable_ranks,
+            "special_tokens": self._special_tokens,
+            "explicit_n_vocab": self._explicit_n_vocab,
+            "merge_engine": self._merge_engine,
+            "cache_size": self._cache_size,
+            "cache_bytes": self._cache_bytes,
+            "compact_ranks": self._compact_ranks,
+            "pretokenizer": self._pretokenizer,
+        }
+
+    def __setstate__(self, value: object) -> None:
+        import tiktoken_py.registry
+
+        if isinstance(value, str):
+            self.__dict__ = tiktoken_py.registry.get_encoding(value).__dict__
+            return
+        self.__init__(**value)
+
+    def warmup(self) -> "Encoding":
+        """Eagerly builds the lazily constructed decoder, sorted tokens, regexes and decode table.
+
+        Useful before forking worker processes, so the children do not build them again. NumPy
+        arrays and memory-mapped vocabularies stay shared with the parent; Python objects such as
+        dicts are shared only until reference counting touches their pages.
+        """
+        self._core_bpe.warmup()
+        return self
+
+    def enable_profiling(self, callback: Optional[Callable[[dict], None]] = None) -> None:
+        """Starts collecting per-stage statistics of `encode` calls.
+
+        `callback`, if given, is called after every encode call with that call's statistics. See
+        `EncodeProfiler` for what is recorded. Profiling adds noticeable overhead while enabled
+        and none when disabled.
+        """
+        self._core_bpe.profiler = EncodeProfiler(callback)
+
+    def disable_profiling(self) -> None:
+        """Stops collecting statistics and discards them."""
+        self._core_bpe.profiler = None
+
+    def profiling_stats(self) -> Optional[dict]:
+        """Returns a snapshot of the statistics collected since profiling was enabled.
+
+        ```
+        >>> enc.enable_profiling()
+        >>> enc.encode("hello world")
+        >>> enc.profiling_stats()["direct_hit_ratio"]
+        1.0
+        ```
+        """
+        profiler = self._core_bpe.profiler
+        return None if profiler is None else profiler.snapshot()
+
+    def cache_info(self) -> CacheInfo:
+        """Returns hit, miss and eviction counters and the current size of the piece cache."""
+        return self._core_bpe.piece_cache.info()
+
+    def cache_clear(self) -> None:
+        """Empties the piece cache and resets its counters."""
+        self._core_bpe.piece_cache.clear()
+
+    def save_cache(self, path: str) -> None:
+        """Writes a snapshot of the piece cache to `path`, so it can be restored after a restart."""
+        self._core_bpe.piece_cache.save(path, self._cache_fingerprint)
+
+    def load_cache(self, path: str) -> int:
+        """Restores the piece cache from a snapshot written by `save_cache`.
+
+        Returns the number of entries loaded. Raises a ValueError if the snapshot was written for a
+        different vocabulary or is not a valid snapshot. Snapshots are plain data, so loading one
+        never runs code from the file.
+        """
+        return self._core_bpe.piece_cache.load(path, self._cache_fingerprint)
+
+    @functools.cached_property
+    def _cache_fingerprint(self) -> bytes:
+        # Computed once: hashing the whole vocabulary takes a few tens of milliseconds
+        return hashlib.sha256(self.name.encode("utf-8") + self._core_bpe.vocab_digest).digest()
+
     @functools.cached_property
     def special_tokens_set(self) -> set[str]:
         return set(self._special_tokens.keys())
@@ -56,6 +204,9 @@ class Encoding:
         *,
         allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
         disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+        num_workers: int = 1,
+        chunk_size: int = 1 << 22,
+        executor: Optional[Executor] = None,
     ) -> list[int]:
         """Encodes a string into tokens.
 
@@ -83,26 +234,111 @@ class Encoding:
         >>> enc.encode("<|endoftext|>", disallowed_special=())
         [27, 91, 437, 1659, 5239, 91, 29]
         ```
+
+        Texts longer than `chunk_size` characters can be encoded in parallel by setting
+        `num_workers` above 1, or by passing an `executor` (e.g. from `process_pool`). The text is
+        cut at positions that are provably piece boundaries of the split regex, so the result is
+        identical to the serial one. This is only supported for the split patterns of the bundled
+        encodings; other encodings, and texts without such positions, are encoded serially.
+        Without an `executor`, the `num_workers` worker processes are started on the first such
+        call and kept for later calls with the same `num_workers`, since starting them and loading
+        the encoding in each costs hundreds of milliseconds; `close_pools` shuts them down.
         """
+        allowed_special, disallowed_special = self._resolve_special(
+            allowed_special, disallowed_special
+        )
+        special_spans = self._scan_special_timed(text, allowed_special, disallowed_special)
+        if (num_workers > 1 or executor is not None) and len(text) > chunk_size:
+            tokens = self._encode_chunked(
+                text, allowed_special, special_spans, chunk_size, num_workers, executor
+            )
+            if tokens is not None:
+                return tokens
+        return self._encode_allowed(text, allowed_special, special_spans)
+
+    def _encode_chunked(
+        self, text, allowed_special, special_spans, chunk_size, num_workers, executor
+    ) -> Optional[list[int]]:
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+        if self._pat_str not in SAFE_SPLIT_PATTERNS:
+            return None
+        if special_spans is None:
+            special_spans = self._core_bpe.special_spans(text, allowed_special)
+        cuts = safe_split_points(text, chunk_size, special_spans)
+        if not cuts:
+            return None
+
+        chunks = [text[start:end] for start, end in zip([0, *cuts], [*cuts, len(text)])]
+        # Disallowed special tokens have already been checked on the whole text
+        kwargs = {"allowed_special": allowed_special, "disallowed_special": ()}
+        if executor is None:
+            executor = self._worker_pool(num_workers)
+        results = self._map_batch("encode", chunks, kwargs, num_workers, executor)
+        return [token for tokens in results for token in tokens]
+
+    def _resolve_special(self, allowed_special, disallowed_special):
+        # Normalises the allowed_special / disallowed_special arguments of encode into a set and a
+        # frozenset respectively
         if allowed_special == "all":
-            allowed_special = self.special_tokens_set 
+            allowed_special = self.special_tokens_set
 
         if disallowed_special == "all":
             disallowed_special = self.special_tokens_set - allowed_special
 
-        if disallowed_special:
-            if not isinstance(disallowed_special, frozenset):
-                disallowed_special = frozenset(disallowed_special)
+        if disallowed_special and not isinstance(disallowed_special, frozenset):
+            disallowed_special = frozenset(disallowed_special)
 
-            if match := _special_token_regex(disallowed_special).search(text):
-                raise ValueError(f"Text contains disallowed special token: {match.group()}")
-        
         if isinstance(allowed_special, frozenset):
             allowed_special = set(allowed_special)
 
+        return allowed_special, disallowed_special
+
+    def _scan_special_timed(self, text, allowed_special, disallowed_special):
+        # _scan_special, reporting the scan time to the profiler when profiling is enabled
+        profiler = self._core_bpe.profiler
+        if profiler is None:
+            return self._scan_special(text, allowed_special, disallowed_special)
+        scan_start = time.perf_counter()
+        special_spans = self._scan_special(text, allowed_special, disallowed_special)
+        profiler.local.special_scan_seconds = time.perf_counter() - scan_start
+        return special_spans
+
+    def _scan_special(self, text, allowed_special, disallowed_special):
+        # Finds the allowed special tokens in the text and rejects disallowed ones in a single pass
+        # of a regex that is compiled once per allowed/disallowed combination. Returns the spans of
+        # the allowed special tokens, or None if the core BPE has to find them itself.
+        if not disallowed_special and not allowed_special:
+            return []
+        allowed_special = self.special_tokens_set.intersection(allowed_special)
+        tokens = frozenset(allowed_special).union(disallowed_special or ())
+        if tokens_overlap(tokens):
+            # Overlapping special tokens may hide each other from a single pass
+            if disallowed_special:
+                if match := _special_token_regex(disallowed_special).search(text):
+                    raise ValueError(f"Text contains disallowed special token: {match.group()}")
+            return None
+
+        spans = []
+        if tokens:
+            for match in _special_token_regex(tokens).finditer(text):
+                # A token that is both allowed and disallowed is disallowed
+                if disallowed_special and match.group() in disallowed_special:
+                    raise ValueError(f"Text contains disallowed special token: {match.group()}")
+                spans.append(match.span())
+        return spans
+
+    def _encode_allowed(
+        self,
+        text: str,
+        allowed_special: AbstractSet[str],
+        special_spans: Optional[list] = None,
+        out: Optional[Union[list[int], array]] = None,
+    ) -> Union[list[int], array]:
+        # Tokens are appended to `out` if given (e.g. an array("I")), else to a new list
         try:
             # Encode the text using BPE
-            tokens, _ = self._core_bpe.encode(text, allowed_special)
+            tokens, _ = self._core_bpe.encode(text, allowed_special, special_spans, out)
             return tokens
         except UnicodeEncodeError:
             # BPE operates on bytes, but the regex operates on unicode. If we pass a str that is
@@ -112,14 +348,505 @@ class Encoding:
             # string, but given that this is input we want to support, maybe that's okay.
             # Also we use errors="replace" to handle weird things like lone surrogates.
             text = text.encode("utf-8", "surrogatepass").decode("utf-8", "replace")
-            tokens, _ = self._core_bpe.encode(text, allowed_special)
+            if out is not None:
+                del out[:]
+            tokens, _ = self._core_bpe.encode(text, allowed_special, None, out)
             return tokens
-        
 
+    def count_tokens(
+        self,
+        text: str,
+        *,
+        limit: Optional[int] = None,
+        allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
+        disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    ) -> int:
+        """Returns the number of tokens `encode` would produce, without building the token list.
+
+        If `limit` is given, counting stops as soon as the count exceeds it, and the returned value
+        is some number greater than `limit` rather than the exact count. This makes checks such as
+        "does this fit in the context window" cheap on huge inputs.
+
+        See `encode` for details on `allowed_special` and `disallowed_special`.
+
+        ```
+        >>> enc.count_tokens("hello world")
+        2
+        >>> enc.count_tokens("hello world " * 1000, limit=10) > 10
+        True
+        ```
+        """
+        allowed_special, disallowed_special = self._resolve_special(
+            allowed_special, disallowed_special
+        )
+        special_spans = self._scan_special(text, allowed_special, disallowed_special)
+        try:
+            return self._core_bpe.count(text, allowed_special, limit, special_spans)
+        except UnicodeEncodeError:
+            # See the comment in _encode_allowed
+            text = text.encode("utf-8", "surrogatepass").decode("utf-8", "replace")
+            return self._core_bpe.count(text, allowed_special, limit)
+
+    def count_tokens_batch(
+        self,
+        text: list[str],
+        *,
+        limit: Optional[int] = None,
+        num_threads: int = 8,
+        executor: Optional[Executor] = None,
+        allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
+        disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    ) -> list[int]:
+        """Counts the tokens of a list of strings, in parallel.
+
+        See `count_tokens` and `encode_batch` for details.
+        """
+        return self._map_batch(
+            "count_tokens",
+            text,
+            {
+                "limit": limit,
+                "allowed_special": allowed_special,
+                "disallowed_special": disallowed_special,
+            },
+            num_threads,
+            executor,
+        )
+
+    def encode_to_numpy(
+        self,
+        text: str,
+        *,
+        allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
+        disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    ) -> np.ndarray:
+        """Encodes a string into tokens, returning a uint32 NumPy array.
+
+        The tokens are appended straight into a growable uint32 buffer that the array then wraps
+        without copying, so no intermediate list of Python ints is built.
+        See `encode` for details on `allowed_special` and `disallowed_special`.
+
+        ```
+        >>> enc.encode_to_numpy("hello world")
+        array([15339,  1917], dtype=uint32)
+        ```
+        """
+        allowed_special, disallowed_special = self._resolve_special(
+            allowed_special, disallowed_special
+        )
+        special_spans = self._scan_special_timed(text, allowed_special, disallowed_special)
+        tokens = self._encode_allowed(text, allowed_special, special_spans, array(_UINT32))
+        return np.frombuffer(tokens, dtype=np.uint32)
+
+    def encode_ordinary(self, text: str) -> list[int]:
+        """Encodes a string into tokens, ignoring special tokens.
+
+        This is equivalent to `encode(text, disallowed_special=())`.
+
+        ```
+        >>> enc.encode_ordinary("hello world")
+        [15339, 1917]
+        ```
+        """
+        return self.encode(text, disallowed_special=())
+
+    def encode_with_offsets(
+        self,
+        text: str,
+        *,
+        allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
+        disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    ) -> TokenOffsets:
+        """Encodes a string into tokens, also returning where each token starts.
+
+        The offsets are collected in the same pass from the regex matches and the token lengths,
+        so mapping tokens back to the text (e.g. for highlighting) does not need to decode them
+        one by one. Returns a `TokenOffsets` with the tokens, as returned by `encode`, and int64
+        arrays of their UTF-8 byte offsets and character offsets.
+
+        See `encode` for details on `allowed_special` and `disallowed_special`.
+
+        ```
+        >>> enc.encode_with_offsets("héllo world")
+        TokenOffsets(tokens=[71, 19010, 385, 1917],
+                     byte_offsets=array([0, 1, 4, 6]),
+                     char_offsets=array([0, 1, 3, 5]))
+        ```
+        """
+        allowed_special, disallowed_special = self._resolve_special(
+            allowed_special, disallowed_special
+        )
+        text = fix_surrogates(text)
+        special_spans = self._scan_special(text, allowed_special, disallowed_special)
+        return encode_with_offsets(self._core_bpe, text, allowed_special, special_spans)
+
+    def truncate(
+        self,
+        text: str,
+        max_tokens: int,
+        *,
+        keep: Literal["start", "end"] = "start",
+        allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
+        disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    ) -> TokenSpan:
+        """Returns the first (`keep="start"`) or last (`keep="end"`) `max_tokens` tokens of a text.
+
+        The result is a `TokenSpan` with the tokens, which are exactly the corresponding slice of
+        `encode(text)`, and the characters they cover. Keeping the start stops encoding as soon as
+        `max_tokens` tokens are found. Keeping the end encodes only a tail of the text for the
+        split patterns of the bundled encodings, starting at a piece boundary, and the whole text
+        otherwise.
+
+        See `encode` for details on `allowed_special` and `disallowed_special`.
+
+        ```
+        >>> enc.truncate("hello world, how are you", 2)
+        TokenSpan(text='hello world', tokens=[15339, 1917], start=0, end=11)
+        ```
+        """
+        if max_tokens < 0:
+            raise ValueError(f"max_tokens must not be negative, got {max_tokens}")
+        if keep not in ("start", "end"):
+            raise ValueError(f"keep must be 'start' or 'end', got {keep!r}")
+        allowed_special, disallowed_special = self._resolve_special(
+            allowed_special, disallowed_special
+        )
+        return truncate(self, text, max_tokens, keep, allowed_special, disallowed_special)
+
+    def chunk(
+        self,
+        text: str,
+        max_tokens: int,
+        *,
+        overlap: int = 0,
+        allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
+        disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    ) -> Iterator[TokenSpan]:
+        """Splits a text into windows of `max_tokens` tokens, consecutive windows sharing `overlap`.
+
+        Yields a `TokenSpan` per window, with its tokens and the characters they cover. The
+        windows are produced from a single encoding pass as the tokens are encoded, so overlapping
+        text is not encoded twice and stopping the iteration stops encoding. The last window may
+        be shorter.
+
+        See `encode` for details on `allowed_special` and `disallowed_special`.
+
+        ```
+        >>> [w.text for w in enc.chunk("one two three four five", 3, overlap=1)]
+        ['one two three', ' three four five']
+        ```
+        """
+        if max_tokens <= 0:
+            raise ValueError(f"max_tokens must be positive, got {max_tokens}")
+        if not 0 <= overlap < max_tokens:
+            raise ValueError(f"overlap must be in [0, max_tokens), got {overlap}")
+        allowed_special, disallowed_special = self._resolve_special(
+            allowed_special, disallowed_special
+        )
+        text = fix_surrogates(text)
+        special_spans = self._scan_special(text, allowed_special, disallowed_special)
+        return chunk(self, text, max_tokens, overlap, allowed_special, special_spans)
+
+    def stream_encoder(
+        self,
+        *,
+        allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
+        disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    ) -> StreamingEncoder:
+        """Returns an incremental encoder that consumes text chunks and emits stable tokens.
+
+        See `StreamingEncoder` for details, and `encode` for `allowed_special` and
+        `disallowed_special`.
+        """
+        allowed_special, disallowed_special = self._resolve_special(
+            allowed_special, disallowed_special
+        )
+        return StreamingEncoder(self, allowed_special, disallowed_special)
+
+    def encode_stream(
+        self,
+        chunks: Iterable[str],
+        *,
+        allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
+        disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    ) -> Iterator[int]:
+        """Encodes an iterable of text chunks, yielding tokens as soon as they are stable.
+
+        The tokens yielded are exactly `encode("".join(chunks))`, but only a bounded tail of the
+        text is held in memory.
+
+        ```
+        >>> with open("big.log") as f:
+        ...     for token in enc.encode_stream(iter(lambda: f.read(1 << 20), "")):
+        ...         ...
+        ```
+        """
+        allowed_special, disallowed_special = self._resolve_special(
+            allowed_special, disallowed_special
+        )
+        return encode_stream(self, chunks, allowed_special, disallowed_special)
+
+    def encode_batch(
+        self,
+        text: list[str],
+        *,
+        num_threads: int = 8,
+        executor: Optional[Executor] = None,
+        allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
+        disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    ) -> list[list[int]]:
+        """Encodes a list of strings into tokens, in parallel.
+
+        If `executor` is given it is used instead of a thread pool of `num_threads` threads. Since
+        the core BPE is pure Python and holds the GIL, use an executor from `process_pool` to encode
+        on several cores. Any other executor works too, but a process pool not created by
+        `process_pool` is sent a pickled copy of the encoding with every batch of tasks. Results
+        are returned in input order.
+
+        See `encode` for more details on `allowed_special` and `disallowed_special`.
+
+        ```
+        >>> enc.encode_batch(["hello world", "goodbye world"])
+        [[15339, 1917], [19045, 29474, 1917]]
+        ```
+        """
+        return self._map_batch(
+            "encode",
+            text,
+            {"allowed_special": allowed_special, "disallowed_special": disallowed_special},
+            num_threads,
+            executor,
+        )
+
+    def encode_ordinary_batch(
+        self,
+        text: list[str],
+        *,
+        num_threads: int = 8,
+        executor: Optional[Executor] = None,
+    ) -> list[list[int]]:
+        """Encodes a list of strings into tokens, in parallel, ignoring special tokens.
+
+        This is equivalent to `encode_batch(text, disallowed_special=())`.
+
+        ```
+        >>> enc.encode_ordinary_batch(["hello world", "goodbye world"])
+        [[15339, 1917], [19045, 29474, 1917]]
+        ```
+        """
+        return self._map_batch("encode_ordinary", text, {}, num_threads, executor)
+
+    def decode_batch(
+        self,
+        batch: list[list[int]],
+        *,
+        errors: str = "replace",
+        num_threads: int = 8,
+        executor: Optional[Executor] = None,
+    ) -> list[str]:
+        """Decodes a batch (list of lists of tokens) into a list of strings, in parallel."""
+        return self._map_batch("decode", batch, {"errors": errors}, num_threads, executor)
+
+    def configure_async(
+        self,
+        *,
+        max_workers: int = 4,
+        max_concurrency: Optional[int] = None,
+        inline_threshold: int = 2048,
+    ) -> None:
+        """Configures the executor used by `aencode`, `adecode` and `acount_tokens`.
+
+        Args:
+            max_workers: The number of worker threads.
+            max_concurrency: The maximum number of calls running at a time; further calls wait
+                for a slot. Defaults to `max_workers`.
+            inline_threshold: Inputs of at most this many characters (or tokens, for `adecode`)
+                run inline on the event loop.
+        """
+        runner = self.__dict__.get("_async_runner")
+        if runner is not None:
+            runner.shutdown()
+        self._async_runner = AsyncRunner(max_workers, max_concurrency, inline_threshold)
+
+    @functools.cached_property
+    def _async_runner(self) -> AsyncRunner:
+        return AsyncRunner()
+
+    def _async_segments(self, text, allowed_special, special_spans):
+        # Cuts the text at safe piece boundaries so that a cancelled call can stop between
+        # segments; falls back to a single segment for other split patterns
+        if self._pat_str not in SAFE_SPLIT_PATTERNS:
+            return [text]
+        if special_spans is None:
+            special_spans = self._core_bpe.special_spans(text, allowed_special)
+        cuts = safe_split_points(text, _ASYNC_SEGMENT_SIZE, special_spans)
+        return [text[start:end] for start, end in zip([0, *cuts], [*cuts, len(text)])]
+
+    async def aencode(
+        self,
+        text: str,
+        *,
+        allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
+        disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    ) -> list[int]:
+        """Encodes a string into tokens without blocking the event loop.
+
+        Equivalent to `encode`; see `configure_async` for how the work is scheduled.
+
+        ```
+        >>> await enc.aencode("hello world")
+        [15339, 1917]
+        ```
+        """
+        allowed_special, disallowed_special = self._resolve_special(
+            allowed_special, disallowed_special
+        )
+
+        def segments():
+            special_spans = self._scan_special(text, allowed_special, disallowed_special)
+            return self._async_segments(text, allowed_special, special_spans)
+
+        def work(segment, out):
+            out.extend(self._encode_allowed(segment, allowed_special))
+
+        return await self._async_runner.run(len(text), segments, work, list)
+
+    async def acount_tokens(
+        self,
+        text: str,
+        *,
+        limit: Optional[int] = None,
+        allowed_special: Union[Literal["all"], AbstractSet[str]] = set(),  # noqa: B006
+        disallowed_special: Union[Literal["all"], Collection[str]] = "all",
+    ) -> int:
+        """Counts tokens without blocking the event loop. See `count_tokens`."""
+        allowed_special, disallowed_special = self._resolve_special(
+            allowed_special, disallowed_special
+        )
+
+        def segments():
+            special_spans = self._scan_special(text, allowed_special, disallowed_special)
+            return self._async_segments(text, allowed_special, special_spans)
+
+        def work(segment, out):
+            counted = sum(out)
+            if limit is not None and counted > limit:
+                return
+            out.append(
+                self.count_tokens(
+                    segment,
+                    limit=None if limit is None else limit - counted,
+                    allowed_special=allowed_special,
+                    disallowed_special=(),
+                )
+            )
+
+        return await self._async_runner.run(len(text), segments, work, sum)
+
+    async def adecode(self, tokens: list[int], errors: str = "replace") -> str:
+        """Decodes a list of tokens into a string without blocking the event loop. See `decode`."""
+
+        def segments():
+            return [
+                tokens[i: i + _ASYNC_SEGMENT_SIZE]
+                for i in range(0, len(tokens), _ASYNC_SEGMENT_SIZE)
+            ]
+
+        def work(segment, out):
+            out.append(bytes(self._core_bpe.decode_bytes(segment)))
+
+        def result(out):
+            return b"".join(out).decode("utf-8", errors=errors)
+
+        return await self._async_runner.run(len(tokens), segments, work, result)
+
+    def tokens_with_prefix(self, prefix: bytes) -> list[int]:
+        """Returns all mergeable tokens whose bytes start with `prefix`.
 
-    def decode(self, tokens: list[int], errors: str = "replace") -> str:
+        Useful for constrained decoding and for completing a partial token. Uses the prefix index
+        of the core BPE, see `TokenIndex`.
+
+        ```
+        >>> enc.decode_batch([[t] for t in enc.tokens_with_prefix(b"hel")])[:3]
+        ['hel', 'held', 'hell']
+        ```
+        """
+        return self._core_bpe.token_index.tokens_with_prefix(prefix)
+
+    def stream_decoder(self, errors: str = "replace") -> StreamingDecoder:
+        """Returns an incremental decoder that only emits complete UTF-8 text.
+
+        Use this instead of re-decoding a growing token list, e.g. when streaming model output.
+        See `StreamingDecoder` for details.
+        """
+        return StreamingDecoder(self, errors)
+
+    def process_pool(self, max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+        """Returns a process pool whose workers each hold a copy of this encoding.
+
+        The encoding is shipped to every worker once, when the worker starts, rather than with
+        every call. Pass the pool as `executor` to the batch methods, and shut it down when done.
+
+        ```
+        >>> with enc.process_pool(4) as pool:
+        ...     enc.encode_batch(texts, executor=pool)
+        ```
+        """
+        pool = ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_worker, initargs=(self,)
+        )
+        # Marks the pool so that _map_batch only sends the encoding name to its workers
+        pool._tiktoken_encoding_name = self.name
+        return pool
+
+    def _worker_pool(self, num_workers: int) -> ProcessPoolExecutor:
+        # Returns the pool kept for num_workers workers, starting it on first use. Pools inherited
+        # through fork belong to the parent and are not reused
+        with self._pools_lock:
+            if self._pools_pid != os.getpid():
+                self._pools = {}
+                self._pools_pid = os.getpid()
+            pool = self._pools.get(num_workers)
+            if pool is None or getattr(pool, "_broken", False):
+                pool = self._pools[num_workers] = self.process_pool(num_workers)
+            return pool
+
+    def close_pools(self) -> None:
+        """Shuts down the worker processes kept by `encode(..., num_workers=...)`."""
+        with self._pools_lock:
+            pools, self._pools = self._pools, {}
+        if self._pools_pid == os.getpid():
+            for pool in pools.values():
+                pool.shutdown()
+
+    def _map_batch(self, method, items, kwargs, num_threads, executor):
+        if executor is None:
+            fn = functools.partial(getattr(self, method), **kwargs)
+            with ThreadPoolExecutor(num_threads) as e:
+                return list(e.map(fn, items))
+
+        if isinstance(executor, ProcessPoolExecutor):
+            # Batch the items up so the per-task overhead is amortised. Workers of a pool from
+            # process_pool already hold the encoding, so only its name travels with the tasks;
+            # for any other pool the encoding is pickled along with every batch
+            if getattr(executor, "_tiktoken_encoding_name", None) == self.name:
+                fn = functools.partial(_worker_call, self.name, method, kwargs)
+            else:
+                fn = functools.partial(getattr(self, method), **kwargs)
+            chunksize = max(1, len(items) // (4 * (os.cpu_count() or 1)))
+            return list(executor.map(fn, items, chunksize=chunksize))
+
+        fn = functools.partial(getattr(self, method), **kwargs)
+        return list(executor.map(fn, items))
+
+    def decode(
+        self, tokens: Union[list[int], np.ndarray, memoryview], errors: str = "replace"
+    ) -> str:
         """Decodes a list of tokens into a string.
 
+        `tokens` may also be a NumPy array or a typed buffer (`array.array`, `memoryview`) of token
+        ids, in which case the lookup is vectorised over a flat table of all token bytes.
+
         WARNING: the default behaviour of this function is lossy, since decoded bytes are not
         guaranteed to be valid UTF-8. You can control this behaviour using the `errors` parameter,
         for instance, setting `errors=strict`.
@@ -132,6 +859,26 @@ class Encoding:
         return self._core_bpe.decode_bytes(tokens).decode("utf-8", errors=errors)
 
 
+# Size of the segments (in characters or tokens) between which async work checks for cancellation
+_ASYNC_SEGMENT_SIZE = 1 << 16
+
+_WORKER_ENCODING: Optional[Encoding] = None
+
+
+def _init_worker(encoding: Encoding) -> None:
+    global _WORKER_ENCODING
+    _WORKER_ENCODING = encoding
+
+
+def _worker_call(name: str, method: str, kwargs: dict, item):
+    if _WORKER_ENCODING is None or _WORKER_ENCODING.name != name:
+        raise RuntimeError(
+            f"Worker has no encoding {name!r}. Create process pools with Encoding.process_pool()."
+        )
+    return getattr(_WORKER_ENCODING, method)(item, **kwargs)
+
+
+@functools.lru_cache(maxsize=128)
 def _special_token_regex(tokens: frozenset[str]):
     inner = "|".join(regex.escape(token) for token in tokens)
 
@@ -1,18 +1,40 @@
 #!/usr/bin/env python3
-from typing import Optional
+from typing import Optional, Union
 import hashlib
 import blobfile
 import base64
+import mmap
 import os
+import struct
+import sys
+from .ranks import CompactRanks
+
+# 二进制词表格式：
+#   header: magic(8) | n_tokens(u32) | table_size(u32) | src_size(u64) | src_mtime_ns(i64) | src_sha256(32)
+#           | payload_sha256(32)，header 之后所有内容的 sha256，加载时校验，保证映射的内容没有被修改
+#   offsets: u32[n_tokens + 1]   每个token在blob中的起始位置
+#   ranks:   u32[n_tokens]       按rank升序排列
+#   table:   u32[table_size]     以 crc32 为哈希、线性探测的开放寻址表，保存 token下标 + 1，0 表示空槽
+#   blob:    所有token字节顺序拼接
+# 数组使用本机字节序，magic 的最后一个字节记录字节序，不一致时重新生成
+BINARY_SUFFIX = ".bin"
+_MAGIC = b"TKBPE2" + (b"L" if sys.byteorder == "little" else b"B") + b"\x00"
+_HEADER = struct.Struct("=8sIIQq32s32s")
+# 未传入 cache_dir 时从该环境变量读取二进制词表的目录，两者都没有时不读写二进制文件（use_mmap 除外）
+BINARY_CACHE_DIR_ENV = "TIKTOKEN_PY_BINARY_CACHE_DIR"
+
 
 def check_hash(data: bytes, expected_hash: str) -> bool:
     actual_hash = hashlib.sha256(data).hexdigest()
     return actual_hash == expected_hash
 
+def _resolve_path(file_path: str) -> str:
+    current_path = os.path.abspath(os.path.dirname(__file__))
+    return os.path.join(current_path, file_path)
+
 def read_file(file_path: str, expected_hash: Optional[str] = None) -> bytes:
     contents = None
-    current_path = os.path.abspath(os.path.dirname(__file__))
-    file_path = os.path.join(current_path, file_path)
+    file_path = _resolve_path(file_path)
     with blobfile.BlobFile(file_path, "rb") as f:
         contents = f.read()
     if expected_hash and not check_hash(contents, expected_hash):
@@ -23,10 +45,145 @@ def read_file(file_path: str, expected_hash: Optional[str] = None) -> bytes:
     return contents
 
 
-def load_tktoken_bpe(tiktoken_bpe_file: str, 
-                     expected_hash: Optional[str] = None
-        ) -> dict[bytes, int]:
-    # NB: do not add caching to this function
+class BinaryRanks(CompactRanks):
+    """A `CompactRanks` backed by a memory-mapped binary vocabulary file.
+
+    Nothing is parsed into Python objects up front: lookups hash the key with crc32, probe the
+    on-disk table and compare against the token bytes in place. Pages are shared between all
+    processes that map the same file. Pickling re-maps the file by path. `verify` checks the mapped
+    contents against the digest recorded when the file was written.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, table_size, _, _, _, self._payload_digest = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a binary vocabulary file for this platform")
+        view = memoryview(self._mm)
+        pos = _HEADER.size
+        offsets = view[pos: pos + 4 * (n + 1)].cast("I")
+        pos += 4 * (n + 1)
+        ranks = view[pos: pos + 4 * n].cast("I")
+        pos += 4 * n
+        table = view[pos: pos + 4 * table_size].cast("I")
+        super().__init__(self._mm, offsets, ranks, table, blob_start=pos + 4 * table_size)
+
+    def __reduce__(self):
+        return (BinaryRanks, (self.path,))
+
+    def verify(self) -> bool:
+        """Returns whether the offsets, ranks, table and tokens match the digest in the header."""
+        payload = memoryview(self._mm)[_HEADER.size:]
+        return hashlib.sha256(payload).digest() == self._payload_digest
+
+
+def dump_tktoken_bpe_binary(
+    tiktoken_bpe_file: str,
+    binary_file: Optional[str] = None,
+    expected_hash: Optional[str] = None,
+) -> str:
+    """Writes the binary form of a `.tiktoken` file, by default next to it, and returns its path.
+
+    The source is read through `read_file`, so `expected_hash` is checked as usual. The digests of
+    the source and of the binary payload are recorded in the header, so the binary can later be
+    validated against both.
+    """
+    contents = read_file(tiktoken_bpe_file, expected_hash)
+    src_path = _resolve_path(tiktoken_bpe_file)
+    binary_file = binary_file or src_path + BINARY_SUFFIX
+    stat = os.stat(src_path)
+
+    compact = CompactRanks.from_items(
+        (base64.b64decode(token), int(rank))
+        for token, rank in (line.split() for line in contents.splitlines() if line)
+    )
+
+    payload = [
+        compact._offsets.tobytes(), compact._ranks.tobytes(), compact._table.tobytes(), compact._blob,
+    ]
+    payload_digest = hashlib.sha256()
+    for part in payload:
+        payload_digest.update(part)
+    header = _HEADER.pack(
+        _MAGIC, len(compact), len(compact._table), stat.st_size, stat.st_mtime_ns,
+        hashlib.sha256(contents).digest(), payload_digest.digest(),
+    )
+    tmp_file = f"{binary_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(header)
+        for part in payload:
+            f.write(part)
+    os.replace(tmp_file, binary_file)
+    return binary_file
+
+
+def _binary_is_fresh(src_path: str, binary_file: str, expected_hash: Optional[str]) -> bool:
+    # 二进制文件需要与源文件对应：校验 magic、源文件大小与修改时间，以及期望的 sha256。
+    # 这里只检查 header，文件内容由 BinaryRanks.verify 校验
+    try:
+        with open(binary_file, "rb") as f:
+            header = f.read(_HEADER.size)
+        stat = os.stat(src_path)
+    except OSError:
+        return False
+    if len(header) != _HEADER.size:
+        return False
+    magic, _, _, src_size, src_mtime_ns, digest, _ = _HEADER.unpack(header)
+    if magic != _MAGIC or src_size != stat.st_size or src_mtime_ns != stat.st_mtime_ns:
+        return False
+    return not expected_hash or digest.hex() == expected_hash
+
+
+def _load_binary(
+    tiktoken_bpe_file: str, binary_file: str, expected_hash: Optional[str]
+) -> Optional[BinaryRanks]:
+    # 使用已有的二进制文件，不存在、过期或内容被修改时重新生成；目录不可写时返回 None
+    src_path = _resolve_path(tiktoken_bpe_file)
+    if _binary_is_fresh(src_path, binary_file, expected_hash):
+        ranks = BinaryRanks(binary_file)
+        if ranks.verify():
+            return ranks
+    try:
+        os.makedirs(os.path.dirname(binary_file), exist_ok=True)
+        dump_tktoken_bpe_binary(tiktoken_bpe_file, binary_file, expected_hash)
+    except OSError:
+        return None
+    ranks = BinaryRanks(binary_file)
+    return ranks if ranks.verify() else None
+
+
+def load_tktoken_bpe(tiktoken_bpe_file: str,
+                     expected_hash: Optional[str] = None,
+                     *,
+                     use_mmap: bool = False,
+                     cache_dir: Optional[str] = None,
+        ) -> Union[dict[bytes, int], BinaryRanks]:
+    """Loads the mergeable ranks of a `.tiktoken` file.
+
+    Local files can be loaded from a binary copy instead of base64-decoding every line. The copy
+    is only used when asked for: pass `cache_dir` or set the `TIKTOKEN_PY_BINARY_CACHE_DIR`
+    environment variable. It is written there on first load, and on every load it is checked
+    against the source file and against the sha256 of its own contents, and rewritten if either
+    check fails. With `use_mmap=True` a `BinaryRanks` mapping over the memory-mapped binary copy is
+    returned instead of a dict; without a cache directory the copy is then kept next to the source.
+    """
+    # NB: no in-memory caching here, registry.get_encoding caches the encodings. The binary copy on
+    # disk is only written with a cache directory or with use_mmap=True
+    src_path = _resolve_path(tiktoken_bpe_file)
+    if cache_dir is None:
+        cache_dir = os.environ.get(BINARY_CACHE_DIR_ENV) or None
+    if cache_dir is None and use_mmap:
+        cache_dir = os.path.dirname(src_path)
+    if cache_dir is not None and os.path.isfile(src_path):
+        binary_file = os.path.join(cache_dir, os.path.basename(src_path) + BINARY_SUFFIX)
+        ranks = _load_binary(tiktoken_bpe_file, binary_file, expected_hash)
+        if ranks is not None:
+            return ranks if use_mmap else ranks.to_dict()
+
+    if use_mmap:
+        raise ValueError(f"Cannot memory-map {tiktoken_bpe_file}: no binary copy is available")
     contents = read_file(tiktoken_bpe_file, expected_hash)
     return {
         base64.b64decode(token): int(rank)
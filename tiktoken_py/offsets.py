@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from array import array
+from typing import TYPE_CHECKING, AbstractSet, Iterator, NamedTuple, Optional
+import numpy as np
+
+if TYPE_CHECKING:
+    from .bbpe import CoreBPE
+
+# UTF-8 中的后续字节 0b10xxxxxx，删除之后每个字符只剩下首字节
+_CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+
+
+class TokenOffsets(NamedTuple):
+    """The tokens of a text with the position where each token starts.
+
+    `byte_offsets[i]` is the offset of token i in the UTF-8 encoding of the text and
+    `char_offsets[i]` its offset in the text; a token starting inside a character that is split
+    between tokens gets the offset of that character.
+    """
+
+    tokens: list[int]
+    byte_offsets: np.ndarray
+    char_offsets: np.ndarray
+
+
+def fix_surrogates(text: str) -> str:
+    """Applies the surrogate fixup of `Encoding.encode` up front.
+
+    Offsets computed on the result refer to the text that is actually encoded.
+    """
+    try:
+        text.encode("utf-8")
+    except UnicodeEncodeError:
+        text = text.encode("utf-8", "surrogatepass").decode("utf-8", "replace")
+    return text
+
+
+def _char_spans(token_bytes: list[bytes], char_pos: int) -> list[tuple[int, int]]:
+    # 片段从字符位置 char_pos 开始时，其中每个token覆盖的字符范围 (start, end)。
+    # 统计 UTF-8 首字节（非 0b10xxxxxx）的数量把字节位置换算为字符位置，
+    # 以后续字节开头的token从前一个字符的中间开始
+    spans = []
+    for b in token_bytes:
+        leads = len(b.translate(None, _CONTINUATION_BYTES))
+        spans.append((char_pos - (b[0] & 0xC0 == 0x80), char_pos + leads))
+        char_pos += leads
+    return spans
+
+
+def encode_with_offsets(
+    core_bpe: "CoreBPE",
+    text: str,
+    allowed_special: AbstractSet[str],
+    special_spans: Optional[list] = None,
+) -> TokenOffsets:
+    """Encodes `text` like `CoreBPE.encode`, also returning the offset where each token starts.
+
+    This is the fast path of `Encoding.encode_with_offsets`: the offsets are appended straight
+    into int64 buffers that the returned arrays wrap, direct vocabulary hits take their length
+    from the piece, and only multi-token pieces look their tokens up in the decoder. Use
+    `token_offsets` to also get the end of each token or to stop encoding early.
+    """
+    pretokenizer = core_bpe.pretokenizer_tls
+    encoder = core_bpe.encoder
+    decoder = core_bpe.decoder
+    if special_spans is None:
+        special_spans = core_bpe.special_spans(text, allowed_special)
+    tokens = []
+    byte_offsets = array("q")
+    char_offsets = array("q")
+    add_byte = byte_offsets.append
+    add_char = char_offsets.append
+    byte_pos = 0
+    start = 0
+    for next_special in [*special_spans, None]:
+        end = len(text) if not next_special else next_special[0]
+        for match in pretokenizer.finditer(text[start:end]):
+            piece = match.group(0).encode('utf-8')
+            char_pos = start + match.start()
+            token = encoder.get(piece)
+            if token is not None:
+                tokens.append(token)
+                add_byte(byte_pos)
+                add_char(char_pos)
+                byte_pos += len(piece)
+                continue
+
+            piece_tokens = core_bpe._encode_piece(piece)
+            tokens.extend(piece_tokens)
+            token_bytes = [decoder[token] for token in piece_tokens]
+            if len(piece) == match.end() - match.start():
+                # 只包含 ASCII 字符，字节位置与字符位置一一对应
+                for b in token_bytes:
+                    add_byte(byte_pos)
+                    add_char(char_pos)
+                    byte_pos += len(b)
+                    char_pos += len(b)
+                continue
+            for b, (char_start, _) in zip(token_bytes, _char_spans(token_bytes, char_pos)):
+                add_byte(byte_pos)
+                add_char(char_start)
+                byte_pos += len(b)
+
+        if next_special:
+            special = text[next_special[0]:next_special[1]]
+            tokens.append(core_bpe.special_tokens_encoder[special])
+            add_byte(byte_pos)
+            add_char(next_special[0])
+            byte_pos += len(special.encode('utf-8'))
+            start = next_special[1]
+    return TokenOffsets(
+        tokens,
+        np.frombuffer(byte_offsets, dtype=np.int64),
+        np.frombuffer(char_offsets, dtype=np.int64),
+    )
+
+
+def token_offsets(
+    core_bpe: "CoreBPE",
+    text: str,
+    allowed_special: AbstractSet[str],
+    special_spans: Optional[list] = None,
+    pos: int = 0,
+) -> Iterator[tuple[int, int, int, int]]:
+    """Yields `(token, byte_start, char_start, char_end)` for the tokens of `text[pos:]`.
+
+    Built on `CoreBPE.encode_pieces`: the positions of the pieces come from the regex matches and
+    the positions inside a piece from the token lengths, so no token is decoded one by one.
+    Character offsets are into `text` and byte offsets into the UTF-8 encoding of `text[pos:]`.
+    A character split between tokens belongs to all of them: a token starting inside it gets its
+    offset as `char_start`. Encoding stops when the caller stops iterating.
+    """
+    decoder = core_bpe.decoder
+    special_tokens_decoder = core_bpe.special_tokens_decoder
+    if pos:
+        text = text[pos:]
+        if special_spans is not None:
+            special_spans = [(s - pos, e - pos) for s, e in special_spans if s >= pos]
+    byte_pos = 0
+    for start, end, tokens in core_bpe.encode_pieces(text, allowed_special, special_spans):
+        start += pos
+        end += pos
+        if len(tokens) == 1:
+            token = tokens[0]
+            token_bytes = decoder.get(token)
+            if token_bytes is None:
+                token_bytes = special_tokens_decoder[token]
+            yield token, byte_pos, start, end
+            byte_pos += len(token_bytes)
+            continue
+        token_bytes = [decoder[token] for token in tokens]
+        if sum(map(len, token_bytes)) == end - start:
+            # 只包含 ASCII 字符，字节位置与字符位置一一对应
+            for token, b in zip(tokens, token_bytes):
+                yield token, byte_pos, start, start + len(b)
+                byte_pos += len(b)
+                start += len(b)
+            continue
+        for token, b, (char_start, char_end) in zip(tokens, token_bytes,
+                                                    _char_spans(token_bytes, start)):
+            yield token, byte_pos, char_start, char_end
+            byte_pos += len(b)
@@ -8,10 +8,55 @@ FIM_MIDDLE = "<|fim_middle|>"
 FIM_SUFFIX = "<|fim_suffix|>"
 ENDOFPROMPT = "<|endofprompt|>"
 
-def cl100k_base():
+CL100K_PAT_STR = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+"""
+
+# This regex could be made more efficient
+O200K_PAT_STR = "|".join(
+    [
+        r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]*[\p{Ll}\p{Lm}\p{Lo}\p{M}]+(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+        r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]+[\p{Ll}\p{Lm}\p{Lo}\p{M}]*(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+        r"""\p{N}{1,3}""",
+        r""" ?[^\s\p{L}\p{N}]+[\r\n/]*""",
+        r"""\s*[\r\n]+""",
+        r"""\s+(?!\S)""",
+        r"""\s+""",
+    ]
+)
+
+# Equivalents of the patterns above for ASCII-only text, for the standard library `re` (see
+# pretokenize.FastPreTokenizer): in ASCII \p{L} is [a-zA-Z], \p{Lu} is [A-Z], \p{Ll} is [a-z],
+# \p{N} is [0-9], \p{Lt}, \p{Lm}, \p{Lo} and \p{M} are empty, and \s is [\t\n\x0b\x0c\r ] (the
+# standard library would also match \x1c-\x1f). The possessive quantifiers of CL100K_PAT_STR
+# never give up a character that could be matched otherwise, so they are plain here.
+_ASCII_WS = r"\t\n\x0b\x0c\r "
+CL100K_ASCII_PAT_STR = "|".join(
+    [
+        r"""'(?i:[sdmt]|ll|ve|re)""",
+        r"""[^\r\na-zA-Z0-9]?[a-zA-Z]+""",
+        r"""[0-9]{1,3}""",
+        rf""" ?[^{_ASCII_WS}a-zA-Z0-9]+[\r\n]*""",
+        rf"""[{_ASCII_WS}]*[\r\n]""",
+        rf"""[{_ASCII_WS}]+(?![^{_ASCII_WS}])""",
+        rf"""[{_ASCII_WS}]+""",
+    ]
+)
+O200K_ASCII_PAT_STR = "|".join(
+    [
+        r"""[^\r\na-zA-Z0-9]?[A-Z]*[a-z]+(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+        r"""[^\r\na-zA-Z0-9]?[A-Z]+[a-z]*(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+        r"""[0-9]{1,3}""",
+        rf""" ?[^{_ASCII_WS}a-zA-Z0-9]+[\r\n/]*""",
+        rf"""[{_ASCII_WS}]*[\r\n]+""",
+        rf"""[{_ASCII_WS}]+(?![^{_ASCII_WS}])""",
+        rf"""[{_ASCII_WS}]+""",
+    ]
+)
+
+def cl100k_base(*, use_mmap: bool = False):
     mergeable_ranks = load_tktoken_bpe(
         "encodings/cl100k/cl100k_base.tiktoken",
         expected_hash="223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7",
+        use_mmap=use_mmap,
     )
     special_tokens = {
         ENDOFTEXT: 100257,
@@ -22,36 +67,25 @@ def cl100k_base():
     }
     return {
         "name": "cl100k_base",
-        "pat_str": r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+""",
+        "pat_str": CL100K_PAT_STR,
         "mergeable_ranks": mergeable_ranks,
         "special_tokens": special_tokens,
     }
 
-def o200k_base():
+def o200k_base(*, use_mmap: bool = False):
     mergeable_ranks = load_tktoken_bpe(
         "encodings/o200k/o200k_base.tiktoken",
         expected_hash="446a9538cb6c348e3516120d7c08b09f57c36495e2acfffe59a5bf8b0cfb1a2d",
+        use_mmap=use_mmap,
     )
 
     special_tokens = {
         ENDOFTEXT: 199999,
         ENDOFPROMPT: 200018,
     }
-    # This regex could be made more efficient
-    pat_str = "|".join(
-        [
-            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]*[\p{Ll}\p{Lm}\p{Lo}\p{M}]+(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
-            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]+[\p{Ll}\p{Lm}\p{Lo}\p{M}]*(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
-            r"""\p{N}{1,3}""",
-            r""" ?[^\s\p{L}\p{N}]+[\r\n/]*""",
-            r"""\s*[\r\n]+""",
-            r"""\s+(?!\S)""",
-            r"""\s+""",
-        ]
-    )
     return {
         "name": "o200k_base",
-        "pat_str": pat_str,
+        "pat_str": O200K_PAT_STR,
         "mergeable_ranks": mergeable_ranks,
         "special_tokens": special_tokens,
     }
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from itertools import chain
+from typing import Optional
+import re
+import regex
+from .openai_public import CL100K_ASCII_PAT_STR, CL100K_PAT_STR, O200K_ASCII_PAT_STR, O200K_PAT_STR
+from .split import _next_safe_split
+
+# 有 ASCII 快速路径的切分正则，以及它们在 ASCII 文本上的等价正则
+FAST_PATTERNS = {
+    CL100K_PAT_STR: CL100K_ASCII_PAT_STR,
+    O200K_PAT_STR: O200K_ASCII_PAT_STR,
+}
+
+
+class RegexPreTokenizer:
+    """Splits text into pieces with the split regex of the encoding, using the `regex` module.
+
+    This is the reference implementation; `finditer` has the signature of `Pattern.finditer` and
+    yields match objects.
+    """
+
+    name = "regex"
+
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        self._regex = regex.compile(pattern)
+
+    def finditer(self, text: str, pos: int = 0, endpos: Optional[int] = None):
+        return self._regex.finditer(text, pos, len(text) if endpos is None else endpos)
+
+
+class FastPreTokenizer(RegexPreTokenizer):
+    """Splits text like `RegexPreTokenizer`, matching ASCII text with a simpler pattern.
+
+    For the split patterns in `FAST_PATTERNS`, ASCII-only text is matched with an equivalent
+    pattern compiled by the standard library `re`, which needs no Unicode property lookups and is
+    about twice as fast. Text containing other characters is cut at safe split points (see
+    `split.safe_split_points`) into segments of roughly `segment_size` characters, and only the
+    segments that are not pure ASCII fall back to the `regex` module. Cutting there never changes
+    the pieces, so the matches are exactly those of the reference.
+    """
+
+    name = "fast"
+
+    def __init__(self, pattern: str, segment_size: int = 256) -> None:
+        super().__init__(pattern)
+        self.segment_size = segment_size
+        self._ascii = re.compile(FAST_PATTERNS[pattern])
+
+    def finditer(self, text: str, pos: int = 0, endpos: Optional[int] = None):
+        if endpos is None:
+            endpos = len(text)
+        if text.isascii():
+            return self._ascii.finditer(text, pos, endpos)
+        segments = self._segments(text, pos, endpos)
+        if len(segments) == 1:
+            matcher, start, end = segments[0]
+            return matcher.finditer(text, start, end)
+        # chain 在 C 中衔接各段的迭代器，每个匹配没有额外的 Python 开销
+        return chain.from_iterable(
+            matcher.finditer(text, start, end) for matcher, start, end in segments
+        )
+
+    def _segments(self, text: str, pos: int, endpos: int) -> list:
+        # 在安全切分位置把 [pos, endpos) 切成约 segment_size 个字符一段，相邻的同类段合并
+        segments = []
+        start = pos
+        while start < endpos:
+            end = endpos
+            if start + self.segment_size < endpos:
+                cut = _next_safe_split(text, start + self.segment_size)
+                if cut is not None and cut < endpos:
+                    end = cut
+            matcher = self._ascii if text[start:end].isascii() else self._regex
+            if segments and segments[-1][0] is matcher:
+                segments[-1][2] = end
+            else:
+                segments.append([matcher, start, end])
+            start = end
+        return segments or [[self._ascii, pos, endpos]]
+
+
+PRETOKENIZERS = {
+    "regex": RegexPreTokenizer,
+    "fast": FastPreTokenizer,
+}
+
+
+def make_pretokenizer(name: str, pattern: str) -> RegexPreTokenizer:
+    """Returns the pre-tokenizer called `name` for `pattern`.
+
+    "fast" falls back to "regex" for patterns without a fast path.
+    """
+    if name not in PRETOKENIZERS:
+        raise ValueError(f"Unknown pre-tokenizer {name}. Available: {list(PRETOKENIZERS)}")
+    if name == "fast" and pattern not in FAST_PATTERNS:
+        name = "regex"
+    return PRETOKENIZERS[name](pattern)
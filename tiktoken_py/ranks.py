@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Iterable, Iterator, Optional
+import hashlib
+import operator
+import struct
+import zlib
+
+
+def vocab_digest(mergeable_ranks: Mapping) -> bytes:
+    """sha256 of the mergeable ranks, in rank order.
+
+    Identifies the vocabulary that a saved cache snapshot or token index was built for: two
+    vocabularies of the same size give different digests.
+    """
+    digest = hashlib.sha256()
+    for token, rank in sorted(mergeable_ranks.items(), key=lambda item: item[1]):
+        digest.update(struct.pack("<II", rank, len(token)))
+        digest.update(token)
+    return digest.digest()
+
+
+def _table_size(n: int) -> int:
+    # 开放寻址表的大小取不小于 2n 的 2 的幂，装载因子不超过 0.5，探测链很短
+    size = 1
+    while size < 2 * n:
+        size <<= 1
+    return size
+
+
+class CompactRanks(Mapping):
+    """A read-only bytes -> rank mapping stored in a few flat arrays instead of a dict.
+
+    All token bytes are concatenated into one blob, sorted by rank, with an offsets array so token
+    i is `blob[offsets[i]: offsets[i + 1]]` and its rank is `ranks[i]`. Lookups by bytes hash the
+    key with crc32 and probe an open addressing table of token indices; lookups by rank are plain
+    array indexing (or a binary search if the ranks have gaps). No per-token Python objects are
+    kept alive, which for cl100k_base is a few MB instead of the tens of MB of a dict plus its
+    reverse dict.
+
+    It supports the dict lookups used by `byte_pair_merge` (`get`, `in`, `[]`). Each lookup is
+    slower than a dict lookup, so this trades encode speed for memory; `decoder` is the matching
+    rank -> bytes mapping.
+    """
+
+    def __init__(self, blob, offsets, ranks, table, blob_start: int = 0) -> None:
+        # blob 可以是 bytes 或 mmap，offsets、ranks、table 可以是 array 或 memoryview，
+        # blob_start 为 blob 中第一个token的位置
+        self._blob = blob
+        self._blob_start = blob_start
+        self._offsets = offsets
+        self._ranks = ranks
+        self._table = table
+        self._mask = len(table) - 1
+        self._len = len(ranks)
+        # ranks 按升序排列且互不相同，首尾分别为 0 与 n - 1 时 rank 就是token的下标
+        self._dense = self._len == 0 or (ranks[0] == 0 and ranks[self._len - 1] == self._len - 1)
+
+    @classmethod
+    def from_items(cls, items: Iterable[tuple[bytes, int]]) -> "CompactRanks":
+        """Builds the arrays from (token bytes, rank) pairs, e.g. `dict.items()`."""
+        entries = sorted((rank, token) for token, rank in items)
+        table_size = _table_size(len(entries))
+        offsets = array("I", [0])
+        ranks = array("I")
+        table = array("I", bytes(4 * table_size))
+        blob = bytearray()
+        mask = table_size - 1
+        for i, (rank, token) in enumerate(entries):
+            ranks.append(rank)
+            blob += token
+            offsets.append(len(blob))
+            slot = zlib.crc32(token) & mask
+            while table[slot]:
+                slot = (slot + 1) & mask
+            # 表中保存 token下标 + 1，0 表示空槽
+            table[slot] = i + 1
+        return cls(bytes(blob), offsets, ranks, table)
+
+    def __reduce__(self):
+        blob = self._blob[self._blob_start: self._blob_start + self._offsets[self._len]]
+        return (CompactRanks, (
+            bytes(blob),
+            array("I", self._offsets),
+            array("I", self._ranks),
+            array("I", self._table),
+        ))
+
+    @property
+    def dense(self) -> bool:
+        """Whether the ranks are exactly 0..n-1, so a rank is also the index of its token."""
+        return self._dense
+
+    def buffers(self):
+        """Returns (blob, offsets) without copying: token i is `blob[offsets[i]: offsets[i + 1]]`."""
+        start = self._blob_start
+        return memoryview(self._blob)[start: start + self._offsets[self._len]], self._offsets
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the arrays, in bytes."""
+        return self._offsets[self._len] + 4 * (2 * self._len + 1 + len(self._table))
+
+    def _token(self, i: int) -> bytes:
+        start = self._blob_start
+        return self._blob[start + self._offsets[i]: start + self._offsets[i + 1]]
+
+    def _index(self, key: bytes) -> int:
+        table = self._table
+        mask = self._mask
+        slot = zlib.crc32(key) & mask
+        while True:
+            idx = table[slot]
+            if idx == 0:
+                return -1
+            if self._token(idx - 1) == key:
+                return idx - 1
+            slot = (slot + 1) & mask
+
+    def get(self, key, default=None):
+        if not isinstance(key, (bytes, bytearray)):
+            return default
+        i = self._index(key)
+        return default if i < 0 else self._ranks[i]
+
+    def __getitem__(self, key: bytes) -> int:
+        rank = self.get(key)
+        if rank is None:
+            raise KeyError(key)
+        return rank
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[bytes]:
+        for i in range(self._len):
+            yield self._token(i)
+
+    def items(self):
+        return zip(iter(self), self._ranks)
+
+    def values(self):
+        return self._ranks
+
+    def token_bytes(self, rank: int, default: Optional[bytes] = None) -> Optional[bytes]:
+        """Returns the bytes of the token with the given rank."""
+        if self._dense:
+            if 0 <= rank < self._len:
+                return self._token(rank)
+            return default
+        i = bisect_left(self._ranks, rank)
+        if i < self._len and self._ranks[i] == rank:
+            return self._token(i)
+        return default
+
+    @property
+    def decoder(self) -> "RankDecoder":
+        """The reverse rank -> bytes mapping, backed by the same arrays."""
+        return RankDecoder(self)
+
+    def to_dict(self) -> dict[bytes, int]:
+        blob = self._blob[self._blob_start: self._blob_start + self._offsets[self._len]]
+        offsets = self._offsets.tolist()
+        tokens = map(blob.__getitem__, map(slice, offsets, offsets[1:]))
+        return dict(zip(tokens, self._ranks.tolist()))
+
+
+class RankDecoder(Mapping):
+    """A read-only rank -> bytes view of a `CompactRanks`, usable in place of a decoder dict."""
+
+    def __init__(self, ranks: CompactRanks) -> None:
+        self._compact = ranks
+
+    def get(self, rank, default=None):
+        try:
+            rank = operator.index(rank)
+        except TypeError:
+            return default
+        return self._compact.token_bytes(rank, default)
+
+    def __getitem__(self, rank: int) -> bytes:
+        token = self.get(rank)
+        if token is None:
+            raise KeyError(rank)
+        return token
+
+    def __contains__(self, rank) -> bool:
+        return self.get(rank) is not None
+
+    def __len__(self) -> int:
+        return len(self._compact)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._compact.values())
+
+    def items(self):
+        return zip(self._compact.values(), iter(self._compact))
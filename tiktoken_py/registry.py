@@ -1,27 +1,124 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import imp
-import importlib
-from multiprocessing.sharedctypes import Value
-from tarfile import ENCODING
-from tkinter import E
-from typing import Any, Optional, Callable
-import pkgutil
+from typing import Iterable, Optional
 from .core import Encoding
+from .load import BinaryRanks
 import threading
 from .openai_public import ENCODING_CONSTRUCTORS
 
+# _lock 只保护 _name_locks 本身，每个编码的构建由各自的锁串行化，
+# 这样不同编码的首次构建可以并发进行，相同编码的并发首次调用只会构建一次
 _lock = threading.Lock()
+_name_locks: dict[str, threading.Lock] = {}
 
 ENCODINGS: dict[str, Encoding] = {}
 
-def get_encoding(encoding_name: str):
+
+def _lock_for(encoding_name: str) -> threading.Lock:
+    with _lock:
+        lock = _name_locks.get(encoding_name)
+        if lock is None:
+            lock = _name_locks[encoding_name] = threading.Lock()
+        return lock
+
+
+def get_encoding(encoding_name: str) -> Encoding:
+    if not isinstance(encoding_name, str):
+        raise ValueError(f"Expected a string in get_encoding, got {type(encoding_name)}")
+
+    # 快速路径：已经构建过的编码直接返回，不需要加锁
+    enc = ENCODINGS.get(encoding_name)
+    if enc is not None:
+        return enc
+
     if encoding_name not in ENCODING_CONSTRUCTORS:
         raise ValueError(
-                f"Unknown encoding {encoding_name}. Plugins found: {_available_plugin_modules()}"
-            )  
-    
-    constructor = ENCODING_CONSTRUCTORS[encoding_name]
-    enc = Encoding(**constructor())
-    ENCODINGS[encoding_name] = enc
-    return enc
\ No newline at end of file
+                f"Unknown encoding {encoding_name}. Known encodings: {list_encoding_names()}"
+            )
+
+    with _lock_for(encoding_name):
+        # 双重检查：等待锁的过程中其他线程可能已经完成了构建
+        enc = ENCODINGS.get(encoding_name)
+        if enc is not None:
+            return enc
+        constructor = ENCODING_CONSTRUCTORS[encoding_name]
+        enc = Encoding(**constructor())
+        ENCODINGS[encoding_name] = enc
+        return enc
+
+
+def _get_shared_encoding(encoding_name: str) -> Encoding:
+    # 与 get_encoding 相同，但词表使用内存映射的 BinaryRanks；已经构建的普通编码会被替换
+    if encoding_name not in ENCODING_CONSTRUCTORS:
+        raise ValueError(
+                f"Unknown encoding {encoding_name}. Known encodings: {list_encoding_names()}"
+            )
+    with _lock_for(encoding_name):
+        enc = ENCODINGS.get(encoding_name)
+        if enc is not None and isinstance(enc._mergeable_ranks, BinaryRanks):
+            return enc
+        constructor = ENCODING_CONSTRUCTORS[encoding_name]
+        enc = Encoding(**constructor(use_mmap=True))
+        ENCODINGS[encoding_name] = enc
+        return enc
+
+
+def preload_encodings(
+    encoding_names: Optional[Iterable[str]] = None,
+    *,
+    warmup: bool = False,
+    shared: bool = False,
+) -> list[Encoding]:
+    """Builds the named encodings (all known encodings by default) so later calls are cache hits.
+
+    Call this at startup, e.g. before forking workers. With `warmup=True` the lazily built parts of
+    each encoding are constructed as well.
+
+    With `shared=True` the vocabulary is not loaded into dicts: it stays in the binary vocabulary
+    file, memory-mapped read-only (see `BinaryRanks`), and the decoder reads from the same mapping.
+    The binary file is written on first use to `TIKTOKEN_PY_BINARY_CACHE_DIR`, or next to the
+    `.tiktoken` file if that is not set (see `load_tktoken_bpe`).
+
+    The saving in memory costs speed: every vocabulary lookup hashes the key with crc32 and probes
+    the mapped table instead of a dict, so encoding with a cold piece cache is roughly 1.6-2.2x
+    slower (cl100k_base, English text: 10.7 ms -> 20.6 ms per 64K characters). Repeated pieces
+    served from the piece cache are not affected. Use `shared=True` when many workers would
+    otherwise each hold a private copy of the vocabulary, and the default dicts when encode
+    throughput matters more than memory.
+    Forked workers inherit the mapping and spawned workers that call `preload_encodings(...,
+    shared=True)` map the same file, so all processes share one copy of the vocabulary in the page
+    cache. Combined with `warmup=True`, the decode table is built once in the parent as a numpy
+    array, which reference counting does not touch either.
+
+    Not everything is shared: each worker still has a few megabytes of private memory for the
+    interpreter, the compiled regexes and the piece cache. With `merge_engine="pair"` the pair
+    table is a dict of a few hundred thousand entries; `warmup=True` builds it in the parent so
+    workers do not rebuild it, but reference counting copies the pages a worker reads. The prefix
+    index of `tokens_with_prefix` is built per process on first use, unless loaded with
+    `CoreBPE.load_token_index`. Calling `gc.freeze()` in the parent before forking keeps the
+    collector from dirtying the remaining inherited objects.
+    """
+    if encoding_names is None:
+        encoding_names = list_encoding_names()
+    get = _get_shared_encoding if shared else get_encoding
+    encodings = [get(name) for name in encoding_names]
+    if warmup:
+        for enc in encodings:
+            enc.warmup()
+    return encodings
+
+
+def evict_encoding(encoding_name: Optional[str] = None) -> None:
+    """Drops a memoized encoding, or all of them if no name is given.
+
+    Encodings that are still referenced elsewhere stay alive; the next `get_encoding` call builds
+    a fresh one.
+    """
+    names = list(ENCODINGS) if encoding_name is None else [encoding_name]
+    for name in names:
+        with _lock_for(name):
+            ENCODINGS.pop(name, None)
+
+
+def list_encoding_names() -> list[str]:
+    return list(ENCODING_CONSTRUCTORS)
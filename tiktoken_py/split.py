@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from bisect import bisect_right
+from typing import Optional, Sequence
+from .openai_public import CL100K_PAT_STR, O200K_PAT_STR
+
+# 只有这些切分正则满足下面的安全切分条件
+SAFE_SPLIT_PATTERNS = frozenset({CL100K_PAT_STR, O200K_PAT_STR})
+
+
+def _is_safe_split(text: str, pos: int) -> bool:
+    # 对 cl100k_base 与 o200k_base 的正则，换行符之后紧跟字母或数字的位置一定是片段边界，
+    # 并且在这里截断文本不会改变前后任何片段：
+    # - 包含换行符的分支（\s*[\r\n]、\s*[\r\n]+、标点之后的 [\r\n]*）都会在最后一个换行符处结束，
+    #   无论后面是否还有文本
+    # - 以字母或数字开头的片段可选的前缀字符 [^\r\n\p{L}\p{N}] 不包含换行符，不会向前吞掉换行符
+    ch = text[pos]
+    return text[pos - 1] == "\n" and (ch.isalpha() or ch.isnumeric())
+
+
+def safe_split_points(
+    text: str, chunk_size: int, special_spans: Sequence[tuple[int, int]] = ()
+) -> list[int]:
+    """找出把 text 切成约 chunk_size 个字符一段的安全切分位置。
+
+    在这些位置切开之后分别编码再拼接，结果与直接编码整段文本完全相同。切分位置不会落在
+    special_spans 中的特殊符号内部。找不到安全位置时，对应的段会一直延长。
+    """
+    starts = [start for start, _ in special_spans]
+    points = []
+    pos = chunk_size
+    while pos < len(text):
+        cut = _next_safe_split(text, pos)
+        if cut is None:
+            break
+        i = bisect_right(starts, cut) - 1
+        if i >= 0 and special_spans[i][0] < cut < special_spans[i][1]:
+            pos = special_spans[i][1]
+            continue
+        points.append(cut)
+        pos = cut + chunk_size
+    return points
+
+
+def _next_safe_split(text: str, pos: int) -> Optional[int]:
+    while True:
+        i = text.find("\n", pos - 1)
+        if i < 0 or i + 1 >= len(text):
+            return None
+        if _is_safe_split(text, i + 1):
+            return i + 1
+        pos = i + 2
+
+
+def _prev_safe_split(text: str, pos: int) -> Optional[int]:
+    # 不大于 pos 的最后一个安全切分位置
+    while pos > 0:
+        i = text.rfind("\n", 0, pos)
+        if i < 0:
+            return None
+        if i + 1 < len(text) and _is_safe_split(text, i + 1):
+            return i + 1
+        pos = i
+    return None
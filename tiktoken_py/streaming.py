@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from typing import TYPE_CHECKING, AbstractSet, Iterable, Iterator, Union
+import codecs
+import operator
+
+if TYPE_CHECKING:
+    from .core import Encoding
+
+
+class StreamingEncoder:
+    """Incrementally encodes text that arrives in chunks.
+
+    `feed` returns the tokens that can no longer change, whatever text follows; the rest is kept
+    buffered until more text arrives or `finish` is called. Concatenating everything returned by
+    `feed` and `finish` gives exactly `encode(full_text)`.
+
+    Tokens never merge across the pieces produced by the split regex, so a piece is final once the
+    text after it can no longer change how it was matched. The last piece may still grow, and so
+    may a piece that ends inside a whitespace run or right before an apostrophe, so these are held
+    back, together with any trailing text that could be the start of an allowed special token.
+    Memory is bounded by the length of the longest such tail rather than the length of the
+    stream.
+
+    ```
+    >>> stream = enc.stream_encoder()
+    >>> stream.feed("hello wor")
+    [15339]
+    >>> stream.feed("ld")
+    []
+    >>> stream.finish()
+    [1917]
+    ```
+    """
+
+    def __init__(
+        self,
+        encoding: "Encoding",
+        allowed_special: AbstractSet[str],
+        disallowed_special: AbstractSet[str],
+    ) -> None:
+        from .core import _special_token_regex
+
+        self._encoding = encoding
+        self._core_bpe = encoding._core_bpe
+        self._allowed_special = allowed_special
+        self._allowed_regex = (
+            _special_token_regex(frozenset(allowed_special)) if allowed_special else None
+        )
+        self._disallowed_regex = (
+            _special_token_regex(frozenset(disallowed_special)) if disallowed_special else None
+        )
+        # Proper prefixes of allowed special tokens; a buffer ending in one of these may still
+        # turn into a special token
+        self._special_prefixes = {
+            token[:i] for token in allowed_special for i in range(1, len(token))
+        }
+        self._max_prefix_len = max((len(p) for p in self._special_prefixes), default=0)
+        # Disallowed special tokens may straddle a chunk boundary, so the check keeps the end of
+        # the text that has already been fed as context
+        self._check_context_len = max((len(t) for t in disallowed_special), default=1) - 1
+        self._check_context = ""
+        self._buffer = ""
+
+    @property
+    def buffered_text(self) -> str:
+        """The text that has been fed but not yet encoded."""
+        return self._buffer
+
+    def feed(self, text: str) -> list[int]:
+        """Adds a chunk of text and returns the tokens that have become stable."""
+        if not text:
+            return []
+        self._check_disallowed(text)
+        self._buffer += text
+        return self._emit_stable()
+
+    def finish(self) -> list[int]:
+        """Encodes whatever is still buffered and resets the encoder for a new stream."""
+        text, self._buffer = self._buffer, ""
+        self._check_context = ""
+        return self._encoding._encode_allowed(text, self._allowed_special) if text else []
+
+    def _check_disallowed(self, text: str) -> None:
+        if self._disallowed_regex is None:
+            return
+        window = self._check_context + text
+        if match := self._disallowed_regex.search(window):
+            raise ValueError(f"Text contains disallowed special token: {match.group()}")
+        if self._check_context_len:
+            self._check_context = window[-self._check_context_len:]
+
+    def _emit_stable(self) -> list[int]:
+        buffer = self._buffer
+
+        # Text that could still become an allowed special token must stay buffered
+        limit = len(buffer)
+        for i in range(max(0, len(buffer) - self._max_prefix_len), len(buffer)):
+            if buffer[i:] in self._special_prefixes:
+                limit = i
+                break
+
+        # The regex split restarts after every allowed special token, so everything up to the
+        # last complete special token before the limit can be encoded as is
+        segment_start = 0
+        if self._allowed_regex is not None:
+            for match in self._allowed_regex.finditer(buffer, 0, limit):
+                segment_start = match.end()
+        tokens = (
+            self._encoding._encode_allowed(buffer[:segment_start], self._allowed_special)
+            if segment_start
+            else []
+        )
+
+        # Every piece of the remaining segment except the last one is final. The pieces are
+        # encoded one by one rather than by re-splitting the prefix, since the split of a
+        # truncated text can differ at its end (e.g. trailing whitespace). If the buffer ends in
+        # what may become a special token, the segment may instead end at the limit, so only the
+        # pieces both splits agree on are final
+        pretokenizer = self._core_bpe.pretokenizer_tls
+        pieces = [m.span() for m in pretokenizer.finditer(buffer, segment_start, len(buffer))][:-1]
+        if limit < len(buffer):
+            truncated = [m.span() for m in pretokenizer.finditer(buffer, segment_start, limit)][:-1]
+            n = 0
+            while n < min(len(pieces), len(truncated)) and pieces[n] == truncated[n]:
+                n += 1
+            pieces = pieces[:n]
+        # A piece can still change if the run that ended it continues into the next piece: a
+        # whitespace run split over two pieces (e.g. "\n" + " " becoming "\n \n"), or letters
+        # followed by an apostrophe that may turn into a contraction (e.g. "don" + "'t")
+        while pieces and _may_extend(buffer, pieces[-1][1]):
+            pieces.pop()
+        cut = pieces[-1][1] if pieces else segment_start
+        for start, end in pieces:
+            tokens.extend(self._encode_piece(buffer[start:end]))
+
+        self._buffer = buffer[cut:]
+        return tokens
+
+    def _encode_piece(self, piece: str) -> list[int]:
+        try:
+            return self._core_bpe.encode_piece(piece.encode("utf-8"))
+        except UnicodeEncodeError:
+            # Same fixup for surrogates as Encoding.encode
+            piece = piece.encode("utf-8", "surrogatepass").decode("utf-8", "replace")
+            return self._core_bpe.encode_piece(piece.encode("utf-8"))
+
+
+def _may_extend(text: str, pos: int) -> bool:
+    return text[pos] == "'" or (text[pos - 1].isspace() and text[pos].isspace())
+
+
+def encode_stream(
+    encoding: "Encoding",
+    chunks: Iterable[str],
+    allowed_special: AbstractSet[str],
+    disallowed_special: AbstractSet[str],
+) -> Iterator[int]:
+    stream = StreamingEncoder(encoding, allowed_special, disallowed_special)
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.finish()
+
+
+class StreamingDecoder:
+    """Incrementally decodes tokens that arrive one at a time or in batches.
+
+    `feed` returns only the text completed by the new tokens; bytes of a multi-byte UTF-8
+    character that is split across tokens are buffered until the character is complete, so no
+    broken characters are ever returned. Each token costs O(1) amortised, independent of how many
+    tokens came before.
+
+    ```
+    >>> stream = enc.stream_decoder()
+    >>> stream.feed(9468)  # first two bytes of "🙂"
+    ''
+    >>> stream.feed([19044])
+    '🙂'
+    ```
+    """
+
+    def __init__(self, encoding: "Encoding", errors: str = "replace") -> None:
+        self._core_bpe = encoding._core_bpe
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors)
+
+    def feed(self, tokens: Union[int, Iterable[int]]) -> str:
+        """Adds one token or a batch of tokens and returns the newly completed text.
+
+        A single token may be any integer type, e.g. an element of a NumPy array from
+        `encode_to_numpy`; a batch may be any iterable, array or buffer accepted by `decode`.
+        """
+        try:
+            tokens = (operator.index(tokens),)
+        except TypeError:
+            pass
+        return self._decoder.decode(bytes(self._core_bpe.decode_bytes(tokens)))
+
+    def finish(self) -> str:
+        """Flushes any incomplete trailing bytes (decoded per `errors`) and resets the decoder."""
+        text = self._decoder.decode(b"", final=True)
+        self._decoder.reset()
+        return text
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from bisect import bisect_left
+from typing import Optional
+import time
+import numpy as np
+from .ranks import vocab_digest
+
+
+class _SortedTokens:
+    # 把 blob + offsets 包装成按字节序排好的 token 序列，供 bisect 使用，不需要为每个 token 创建 bytes 对象
+    def __init__(self, blob: bytes, offsets: np.ndarray) -> None:
+        self._blob = blob
+        self._offsets = offsets.tolist()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return self._blob[self._offsets[i]: self._offsets[i + 1]]
+
+
+class TokenIndex:
+    """A prefix index over the vocabulary, equivalent to a byte trie flattened into sorted arrays.
+
+    The tokens are stored in byte order as one contiguous blob plus offsets, with their ranks
+    alongside. All tokens sharing a prefix form a contiguous range, found with two binary searches,
+    which serves prefix queries (e.g. for constrained decoding or completing a partial token) and
+    longest-prefix matching. A 64K table of the two-byte tokens answers whether a piece can merge
+    at all, so `byte_pair_merge` can be skipped for pieces that cannot. `CoreBPE` only uses that
+    check once the index exists; encoding never builds the index.
+
+    `build_seconds` and `nbytes` report the cost of the index. It can be written with `save` and
+    read with `load`, so workers do not have to sort the vocabulary again; `vocab_digest` records
+    the vocabulary it was built for (see `ranks.vocab_digest`).
+    """
+
+    def __init__(
+        self,
+        blob: bytes,
+        offsets: np.ndarray,
+        ranks: np.ndarray,
+        pairs: np.ndarray,
+        build_seconds: float = 0.0,
+        vocab_digest: bytes = b"",
+    ) -> None:
+        self.blob = blob
+        self.offsets = offsets
+        self.ranks = ranks
+        self.pairs = pairs
+        self.build_seconds = build_seconds
+        self.vocab_digest = vocab_digest
+        self._tokens = _SortedTokens(blob, offsets)
+        self._ranks = ranks.tolist()
+
+    @classmethod
+    def build(cls, sorted_token_bytes: list[bytes], encoder: dict[bytes, int]) -> "TokenIndex":
+        """Builds the index from `CoreBPE.sorted_token_bytes`."""
+        start = time.perf_counter()
+        lengths = np.fromiter(map(len, sorted_token_bytes), dtype=np.int64,
+                              count=len(sorted_token_bytes))
+        offsets = np.zeros(len(sorted_token_bytes) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        ranks = np.fromiter((encoder[token] for token in sorted_token_bytes), dtype=np.int64,
+                            count=len(sorted_token_bytes))
+        pairs = np.zeros(1 << 16, dtype=bool)
+        for token in sorted_token_bytes:
+            if len(token) == 2:
+                pairs[(token[0] << 8) | token[1]] = True
+        index = cls(b"".join(sorted_token_bytes), offsets, ranks, pairs,
+                    vocab_digest=vocab_digest(encoder))
+        index.build_seconds = time.perf_counter() - start
+        return index
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the index arrays, in bytes."""
+        return len(self.blob) + self.offsets.nbytes + self.ranks.nbytes + self.pairs.nbytes
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def save(self, path: str) -> None:
+        # numpy 的 .npz 格式，np.savez 会自动补全 .npz 后缀，这里直接写入文件对象以保持路径不变
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                blob=np.frombuffer(self.blob, dtype=np.uint8),
+                offsets=self.offsets,
+                ranks=self.ranks,
+                pairs=self.pairs,
+                vocab_digest=np.frombuffer(self.vocab_digest, dtype=np.uint8),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "TokenIndex":
+        start = time.perf_counter()
+        with np.load(path) as data:
+            # 旧的索引文件没有记录词表摘要，加载到 CoreBPE 时会被拒绝
+            digest = data["vocab_digest"].tobytes() if "vocab_digest" in data else b""
+            index = cls(data["blob"].tobytes(), data["offsets"], data["ranks"], data["pairs"],
+                        vocab_digest=digest)
+        index.build_seconds = time.perf_counter() - start
+        return index
+
+    def prefix_range(self, prefix: bytes, lo: int = 0, hi: Optional[int] = None) -> tuple[int, int]:
+        """Returns the range [start, end) of sorted positions of the tokens starting with `prefix`."""
+        if hi is None:
+            hi = len(self._tokens)
+        start = bisect_left(self._tokens, prefix, lo, hi)
+        # 所有以 prefix 开头的 token 都小于 prefix 的"后继"：去掉末尾的 0xff 之后最后一个字节加一
+        upper = prefix.rstrip(b"\xff")
+        if not upper:
+            return start, hi
+        upper = upper[:-1] + bytes([upper[-1] + 1])
+        return start, bisect_left(self._tokens, upper, start, hi)
+
+    def tokens_with_prefix(self, prefix: bytes) -> list[int]:
+        """Returns the ranks of all tokens starting with `prefix`, in byte order of the tokens."""
+        start, end = self.prefix_range(prefix)
+        return self._ranks[start:end]
+
+    def has_prefix(self, prefix: bytes) -> bool:
+        """Returns whether any token starts with `prefix`."""
+        start, end = self.prefix_range(prefix)
+        return start < end
+
+    def longest_prefix(self, data: bytes) -> Optional[tuple[int, int]]:
+        """Returns (rank, length) of the longest token that is a prefix of `data`, if any."""
+        tokens = self._tokens
+        lo, hi = 0, len(tokens)
+        best = None
+        for k in range(1, len(data) + 1):
+            # 逐字节缩小范围，相当于沿着 trie 向下走一层
+            lo, hi = self.prefix_range(data[:k], lo, hi)
+            if lo == hi:
+                break
+            # 与 data[:k] 完全相等的 token 在范围内排在第一个
+            if self.offsets[lo + 1] - self.offsets[lo] == k:
+                best = (self._ranks[lo], k)
+        return best
+
+    def can_merge(self, piece: bytes) -> bool:
+        """Returns whether any two adjacent bytes of `piece` form a token.
+
+        If not, `byte_pair_merge` cannot merge anything and every byte is its own token.
+        """
+        data = np.frombuffer(piece, dtype=np.uint8).astype(np.int64)
+        return bool(self.pairs[(data[:-1] << 8) | data[1:]].any())